@@ -0,0 +1,168 @@
+# ai_client.py - CHIAMATE LLM ASINCRONE CON CONCORRENZA LIMITATA
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Callable, Dict, Tuple
+
+from metrics import GEMINI_LATENCY
+
+logger = logging.getLogger(__name__)
+
+
+class AIGateway:
+    """Runs generations on an ``LLMBackend`` with bounded concurrency.
+
+    At most ``max_concurrency`` upstream calls are in flight; the slot is
+    released only when the call has really finished. A call that times out
+    is cancelled; if it has not stopped within ``cancel_grace`` seconds it
+    is counted as leaked until it eventually completes.
+    """
+
+    def __init__(self, backend, max_concurrency: int = 8, cancel_grace: float = 2.0):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.cancel_grace = cancel_grace
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.leaked = 0
+        self.total_calls = 0
+        self.total_timeouts = 0
+        self.total_leaked = 0
+
+    async def _acquire(self):
+        await self._semaphore.acquire()
+        self.in_flight += 1
+        self.total_calls += 1
+
+    def _release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    async def generate(self, api_key: str, mode: str, language: str, prompt: str,
+                       timeout: float, **options) -> str:
+        """Whole reply text, bounded by ``timeout``."""
+        await self._acquire()
+        started = time.perf_counter()
+        task = asyncio.ensure_future(self.backend.generate(api_key, mode, language, prompt, **options))
+
+        def finished(_):
+            GEMINI_LATENCY.observe(time.perf_counter() - started, kind='generate')
+            self._release()
+        task.add_done_callback(finished)
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.total_timeouts += 1
+            await self._abandon(task)
+            raise
+        except asyncio.CancelledError:
+            await self._abandon(task)
+            raise
+
+    async def _abandon(self, task: asyncio.Task):
+        task.cancel()
+        done, _ = await asyncio.wait({task}, timeout=self.cancel_grace)
+        if done:
+            return
+        self.leaked += 1
+        self.total_leaked += 1
+        logger.warning("⚠️ Chiamata LLM non cancellabile, resta in esecuzione")
+
+        def settled(_):
+            self.leaked -= 1
+        task.add_done_callback(settled)
+
+    async def stream(self, api_key: str, mode: str, language: str, prompt: str,
+                     idle_timeout: float, **options) -> AsyncIterator[str]:
+        """Yield the reply text as it arrives; waiting more than
+        ``idle_timeout`` for the next piece (the first included) raises
+        ``asyncio.TimeoutError``."""
+        await self._acquire()
+        started = time.perf_counter()
+        chunks = self.backend.stream(api_key, mode, language, prompt, **options).__aiter__()
+        try:
+            while True:
+                try:
+                    text = await asyncio.wait_for(chunks.__anext__(), timeout=idle_timeout)
+                except StopAsyncIteration:
+                    return
+                yield text
+        except asyncio.TimeoutError:
+            self.total_timeouts += 1
+            raise
+        finally:
+            aclose = getattr(chunks, 'aclose', None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception:
+                    pass
+            GEMINI_LATENCY.observe(time.perf_counter() - started, kind='stream')
+            self._release()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'leaked': self.leaked,
+            'total_calls': self.total_calls,
+            'total_timeouts': self.total_timeouts,
+            'total_leaked': self.total_leaked,
+        }
+
+
+# ==================== REGISTRO MODELLI ====================
+class ModelRegistry:
+    """Builds each ``GenerativeModel`` once and reuses it.
+
+    Models are cached per ``(api_key, mode, language)``. Every API key gets
+    its own sync/async service clients built with explicit client options,
+    so requests never depend on the process-global ``genai.configure``
+    state and concurrent calls with different keys cannot race on it.
+    """
+
+    def __init__(self, genai, model_name: str, safety_settings, params_for: Callable[[str, str], Dict]):
+        # None: importa google.generativeai solo al primo modello richiesto
+        self._genai = genai
+        self.model_name = model_name
+        self.safety_settings = safety_settings
+        self.params_for = params_for
+        self._models: Dict[Tuple[str, str, str], object] = {}
+        self._clients: Dict[str, Tuple[object, object]] = {}
+
+    @property
+    def genai(self):
+        if self._genai is None:
+            import google.generativeai
+            self._genai = google.generativeai
+        return self._genai
+
+    def _clients_for(self, api_key: str):
+        clients = self._clients.get(api_key)
+        if clients is None:
+            from google.ai import generativelanguage as glm
+            from google.api_core.client_options import ClientOptions
+            options = ClientOptions(api_key=api_key)
+            clients = self._clients[api_key] = (
+                glm.GenerativeServiceClient(client_options=options),
+                glm.GenerativeServiceAsyncClient(client_options=options),
+            )
+        return clients
+
+    def get(self, api_key: str, mode: str, language: str):
+        key = (api_key, mode, language)
+        model = self._models.get(key)
+        if model is None:
+            params = self.params_for(mode, language)
+            model = self.genai.GenerativeModel(
+                self.model_name,
+                generation_config=self.genai.types.GenerationConfig(**params),
+                safety_settings=self.safety_settings
+            )
+            model._client, model._async_client = self._clients_for(api_key)
+            self._models[key] = model
+            logger.debug(f"🧩 Modello creato per {mode}/{language} (key {api_key[:10]}...)")
+        return model
+
+    def __len__(self) -> int:
+        return len(self._models)
@@ -0,0 +1,73 @@
+# bench_credits.py - deduzioni al secondo per backend crediti
+#
+#   python benchmarks/bench_credits.py [--users 5000] [--ops 2000] [--threads 8]
+#
+# Confronta la riscrittura completa del file JSON (comportamento originale)
+# con il ledger SQLite e con la tabella in memoria + journal.
+import os
+import sys
+import time
+import json
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from credit_store import JsonCreditStore, SQLiteCreditStore, JournalCreditStore
+
+
+def seed(store, users):
+    balances = {uid: 1_000_000 for uid in range(users)}
+    if isinstance(store, JsonCreditStore):
+        store._save({str(k): v for k, v in balances.items()})
+    else:
+        store.import_balances(balances)
+
+
+def run(store, users, ops, threads):
+    per_thread = ops // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            store.deduct((offset + i * 7919) % users, 1)
+
+    pool = [threading.Thread(target=worker, args=(t,)) for t in range(threads)]
+    start = time.perf_counter()
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Credit store deduction benchmark')
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--ops', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            'json_rewrite': lambda: JsonCreditStore(os.path.join(tmp, 'credits.json')),
+            'sqlite_wal': lambda: SQLiteCreditStore(os.path.join(tmp, 'credits.db')),
+            'memory_journal': lambda: JournalCreditStore(os.path.join(tmp, 'journal')),
+        }
+        for name, factory in backends.items():
+            store = factory()
+            seed(store, args.users)
+            results[name] = run(store, args.users, args.ops, args.threads)
+            store.close()
+
+    baseline = results['json_rewrite']
+    print(f"users={args.users} ops={args.ops} threads={args.threads}")
+    for name, rate in results.items():
+        print(f"{name:>16}: {rate:10.0f} deductions/s  ({rate / baseline:6.1f}x)")
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+# bench_pipeline.py - benchmark end-to-end di on_message e dei comandi, offline
+#
+#   python benchmarks/bench_pipeline.py [--messages 2000] [--concurrency 200]
+#                                       [--latency 0.2] [--jitter 0.05] [--stream]
+#                                       [--repeat 0.0] [--output results.json]
+#
+# Importa discord_bot con credenziali finte in una cartella temporanea e
+# sostituisce solo i confini esterni: messaggi/canali/contesti/interazioni
+# Discord finti e un backend LLM finto con latenza configurabile. Tutto
+# il resto (crediti, rate limit, coda AI, cache, invio) è il codice vero.
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import resource
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from llm_backends import LLMBackend
+
+PROMPTS = ["Tell me a story", "Explain Python", "Write a poem"]
+
+
+def percentiles(samples):
+    if not samples:
+        return {'count': 0, 'p50': None, 'p95': None, 'p99': None}
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+    return {'count': len(ordered), 'p50': pick(0.50), 'p95': pick(0.95), 'p99': pick(0.99)}
+
+
+# ==================== DISCORD FINTO ====================
+class FakeSent:
+    def __init__(self, channel, content):
+        self.channel = channel
+        self.content = content
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeChannel:
+    """DM channel that records when each message was sent."""
+
+    def __init__(self, channel_id, on_send=None):
+        self.id = channel_id
+        self.name = f"dm-{channel_id}"
+        self.on_send = on_send
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        if self.on_send is not None:
+            self.on_send(self)
+        return FakeSent(self, content)
+
+    def typing(self):
+        return FakeTyping()
+
+
+class FakeAvatar:
+    url = 'https://cdn.example/avatar.png'
+
+
+class FakeUser:
+    bot = False
+    display_avatar = FakeAvatar()
+
+    def __init__(self, user_id, channel):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.mention = f"<@{user_id}>"
+        self.dm = channel
+
+    async def send(self, content=None, **kwargs):
+        return await self.dm.send(content, **kwargs)
+
+
+class FakeMessage:
+    guild = None
+
+    def __init__(self, author, content, channel):
+        self.author = author
+        self.content = content
+        self.channel = channel
+
+
+class FakeContext:
+    guild = None
+
+    def __init__(self, author, channel):
+        self.author = author
+        self.channel = channel
+        self.message = FakeMessage(author, '', channel)
+
+    async def send(self, content=None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+
+class FakeResponse:
+    def __init__(self, channel):
+        self.channel = channel
+
+    async def send_message(self, content=None, **kwargs):
+        await self.channel.send(content)
+
+    async def defer(self, **kwargs):
+        pass
+
+
+class FakeInteraction:
+    guild = None
+
+    def __init__(self, user, channel):
+        self.user = user
+        self.channel = channel
+        self.response = FakeResponse(channel)
+        self.followup = FakeResponse(channel)
+        self.followup.send = self.followup.send_message
+
+
+# ==================== MODELLO FINTO ====================
+class StubBackend(LLMBackend):
+    """Replies after a fixed latency (+ uniform jitter); streamed replies
+    spread the same latency over ``chunks`` pieces."""
+
+    name = 'stub'
+
+    def __init__(self, latency, jitter, reply_chars=1200, chunks=6, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.reply = ('Lorem ipsum dolor sit amet. ' * (reply_chars // 28 + 1))[:reply_chars]
+        self.chunks = chunks
+        self.rng = random.Random(seed)
+        self.calls = 0
+        self.durations = []
+
+    def _delay(self):
+        self.calls += 1
+        delay = max(0.0, self.latency + self.rng.uniform(-self.jitter, self.jitter))
+        self.durations.append(delay)
+        return delay
+
+    async def generate(self, api_key, mode, language, prompt, **options):
+        await asyncio.sleep(self._delay())
+        return self.reply
+
+    async def stream(self, api_key, mode, language, prompt, **options):
+        delay = self._delay()
+        size = len(self.reply) // self.chunks + 1
+        parts = [self.reply[i:i + size] for i in range(0, len(self.reply), size)]
+        for part in parts:
+            await asyncio.sleep(delay / len(parts))
+            yield part
+
+
+# ==================== SCENARI ====================
+def timed(fn, samples):
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            samples.append(time.perf_counter() - started)
+    return wrapper
+
+
+async def bench_messages(bot_module, args, model):
+    stages = {'on_message': [], 'first_send': [], 'credit_reserve': []}
+    credit_service = bot_module.credit_service
+    credit_service.reserve = timed(credit_service.reserve, stages['credit_reserve'])
+
+    rng = random.Random(1)
+    received = {}
+
+    def on_send(channel):
+        started = received.pop(channel.id, None)
+        if started is not None:
+            stages['first_send'].append(time.perf_counter() - started)
+
+    # Un utente (e un DM) per messaggio: il throttle per utente non entra in gioco
+    messages = []
+    for i in range(args.messages):
+        user_id = 10_000_000 + i
+        channel = FakeChannel(20_000_000 + i, on_send)
+        if rng.random() < args.repeat:
+            text = rng.choice(PROMPTS)
+        else:
+            text = f"Question number {i}: how does feature {rng.randrange(10 ** 6)} work?"
+        messages.append(FakeMessage(FakeUser(user_id, channel), text, channel))
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def deliver(message):
+        async with semaphore:
+            started = time.perf_counter()
+            received[message.channel.id] = started
+            await bot_module.on_message(message)
+            stages['on_message'].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(deliver(m) for m in messages))
+    wall = time.perf_counter() - started
+
+    stages['model'] = model.durations
+    stages['queue_wait'] = list(bot_module.ai_scheduler.waits)
+    stages['outbound_delay'] = list(bot_module.outbound.delays)
+    return {
+        'messages': args.messages,
+        'wall_s': wall,
+        'messages_per_s': args.messages / wall,
+        'upstream_calls': model.calls,
+        'stages': {name: percentiles(samples) for name, samples in stages.items()},
+        'cache': bot_module.response_cache.stats(),
+        'coalescing': bot_module.ai_coalescer.stats(),
+        'outbound': bot_module.outbound.stats(),
+    }
+
+
+async def bench_commands(bot_module, args):
+    prefix = ['credits', 'english', 'italian', 'status', 'help', 'myid', 'reset']
+    slash = {
+        'dm': bot_module.dm_command, 'start': bot_module.slash_start, 'credits': bot_module.slash_credits,
+        'english': bot_module.slash_english, 'myid': bot_module.slash_myid,
+    }
+    results = {}
+    # Canali (e utenti) diversi per ogni comando: il bucket di invio per canale
+    # (5 ogni 5 s) altrimenti misurerebbe il benchmark, non il comando
+    for n, name in enumerate(prefix):
+        command = bot_module.bot.get_command(name)
+        samples = []
+        for i in range(args.commands):
+            channel = FakeChannel(30_000_000 + n * args.commands + i)
+            ctx = FakeContext(FakeUser(40_000_000 + n * args.commands + i, channel), channel)
+            started = time.perf_counter()
+            await command.callback(ctx)
+            samples.append(time.perf_counter() - started)
+        results[f"!{name}"] = percentiles(samples)
+    for n, (name, command) in enumerate(slash.items()):
+        samples = []
+        for i in range(args.commands):
+            channel = FakeChannel(50_000_000 + n * args.commands + i)
+            interaction = FakeInteraction(FakeUser(60_000_000 + n * args.commands + i, channel), channel)
+            started = time.perf_counter()
+            await command.callback(interaction)
+            samples.append(time.perf_counter() - started)
+        results[f"/{name}"] = percentiles(samples)
+    return results
+
+
+async def run(args):
+    import discord_bot
+
+    model = StubBackend(args.latency, args.jitter)
+    discord_bot.ai_backend = discord_bot.ai_gateway.backend = model
+    discord_bot.STREAM_RESPONSES = args.stream
+    # Niente login: process_commands userebbe bot.user, i comandi sono misurati a parte
+    async def no_commands(message):
+        return None
+    discord_bot.bot.process_commands = no_commands
+    if not args.real_limits:
+        limiter = discord_bot.rate_limiter
+        limiter.USER_LIMIT = limiter.GUILD_LIMIT = limiter.GLOBAL_LIMIT = 10 ** 9
+
+    await discord_bot.start_subsystems()
+    try:
+        report = {'messages': await bench_messages(discord_bot, args, model)}
+        report['commands'] = await bench_commands(discord_bot, args)
+    finally:
+        await discord_bot.stop_subsystems()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline end-to-end message pipeline benchmark')
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200, help='on_message calls in flight at once')
+    parser.add_argument('--latency', type=float, default=0.2, help='stub model latency (s)')
+    parser.add_argument('--jitter', type=float, default=0.05)
+    parser.add_argument('--stream', action='store_true', help='use the streaming reply path')
+    parser.add_argument('--repeat', type=float, default=0.0,
+                        help='fraction of messages drawn from the canned /dm prompts '
+                             '(coalescing; also the cache with RESPONSE_CACHE=1)')
+    parser.add_argument('--commands', type=int, default=200, help='invocations per command')
+    parser.add_argument('--real-limits', action='store_true', help='keep the production command rate limits')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    # Stato (database, log, journal) in una cartella usa e getta
+    workdir = tempfile.mkdtemp(prefix='bench_pipeline_')
+    os.chdir(workdir)
+    os.environ.update({
+        'DISCORD_TOKEN': 'bench-token',
+        'GEMINI_API_KEY_1': 'AIza-bench-key',
+        'LOG_LEVEL': 'WARNING',
+        'PORT': '0',
+    })
+
+    report = asyncio.run(run(args))
+    report['config'] = vars(args)
+    # ru_maxrss è in KiB su Linux, in byte su macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    report['peak_rss_mib'] = maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+    msgs = report['messages']
+    print(f"messages: {msgs['messages']} in {msgs['wall_s']:.2f}s -> {msgs['messages_per_s']:.1f} msg/s "
+          f"({msgs['upstream_calls']} upstream calls)")
+    print(f"{'stage':<16} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, p in list(msgs['stages'].items()) + list(report['commands'].items()):
+        if p['count']:
+            print(f"{name:<16} {p['p50'] * 1000:9.2f} {p['p95'] * 1000:9.2f} {p['p99'] * 1000:9.2f}")
+    print(f"peak RSS: {report['peak_rss_mib']:.1f} MiB")
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# bench_rate_limit.py - controlli al secondo del rate limiter
+#
+#   python benchmarks/bench_rate_limit.py [--users 20000] [--checks 500000]
+#
+# Confronta l'implementazione originale (lista ricostruita a ogni controllo,
+# time.time()) con SlidingWindow e TokenBucket di rate_limit.py.
+import os
+import sys
+import time
+import json
+import random
+import argparse
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limit import SlidingWindow, TokenBucket
+
+
+class LegacyWindow:
+    """Copia della logica originale di RateLimiter.check_user_limit."""
+
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self.commands = defaultdict(list)
+
+    def hit(self, key=None):
+        now = time.time()
+        self.commands[key] = [t for t in self.commands[key] if now - t < self.window]
+        if len(self.commands[key]) >= self.limit:
+            return False
+        self.commands[key].append(now)
+        return True
+
+
+def run(limiter, keys):
+    hit = limiter.hit
+    start = time.perf_counter()
+    for key in keys:
+        hit(key)
+    return len(keys) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rate limiter micro-benchmark')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--checks', type=int, default=500000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    user_keys = [rng.randrange(args.users) for _ in range(args.checks)]
+    global_keys = [None] * args.checks
+
+    scenarios = {
+        'user (5/10s)': (user_keys, 5, 10),
+        'global (60/60s)': (global_keys, 60, 60),
+    }
+    results = {}
+    for scenario, (keys, limit, window) in scenarios.items():
+        results[scenario] = {
+            'legacy_list': run(LegacyWindow(limit, window), keys),
+            'sliding_deque': run(SlidingWindow(limit, window), keys),
+            'token_bucket': run(TokenBucket(limit, window), keys),
+        }
+
+    print(f"users={args.users} checks={args.checks}")
+    for scenario, rates in results.items():
+        baseline = rates['legacy_list']
+        print(scenario)
+        for name, rate in rates.items():
+            print(f"  {name:>14}: {rate:12.0f} checks/s  ({rate / baseline:5.1f}x)")
+    print(json.dumps(results))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# bench_shared_rate_limit.py - throughput del rate limiter condiviso
+#
+#   python benchmarks/bench_shared_rate_limit.py [--procs 4] [--checks 5000]
+#
+# Avvia N processi che controllano lo stesso database SQLite e verifica
+# che il limite globale resti rispettato sommando i permessi concessi.
+import os
+import sys
+import time
+import json
+import random
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rate_limit import MemoryRateLimitBackend, SQLiteRateLimitBackend
+
+GLOBAL_LIMIT = 60
+GLOBAL_WINDOW = 60
+
+
+def worker(path, checks, users, seed, results):
+    backend = SQLiteRateLimitBackend(path)
+    rng = random.Random(seed)
+    admitted_global = 0
+    start = time.perf_counter()
+    for _ in range(checks):
+        backend.hit('user', rng.randrange(users), 5, 10)
+        admitted_global += backend.hit('global', 0, GLOBAL_LIMIT, GLOBAL_WINDOW)
+    results.put((checks * 2, time.perf_counter() - start, admitted_global))
+    backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Shared rate limiter throughput benchmark')
+    parser.add_argument('--procs', type=int, default=4)
+    parser.add_argument('--checks', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=10000)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    memory = MemoryRateLimitBackend()
+    start = time.perf_counter()
+    for _ in range(args.checks):
+        memory.hit('user', rng.randrange(args.users), 5, 10)
+        memory.hit('global', 0, GLOBAL_LIMIT, GLOBAL_WINDOW)
+    memory_rate = args.checks * 2 / (time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'rate_limits.db')
+        SQLiteRateLimitBackend(path).close()
+        results = multiprocessing.Queue()
+        procs = [
+            multiprocessing.Process(target=worker, args=(path, args.checks, args.users, i, results))
+            for i in range(args.procs)
+        ]
+        start = time.perf_counter()
+        for p in procs:
+            p.start()
+        outcomes = [results.get() for _ in procs]
+        for p in procs:
+            p.join()
+        wall = time.perf_counter() - start
+
+    total_checks = sum(o[0] for o in outcomes)
+    admitted = sum(o[2] for o in outcomes)
+    report = {
+        'memory_single_process_checks_per_s': memory_rate,
+        'sqlite_shared_checks_per_s': total_checks / wall,
+        'processes': args.procs,
+        'global_admitted': admitted,
+        'global_limit': GLOBAL_LIMIT,
+        'consistent': admitted <= GLOBAL_LIMIT,
+    }
+    print(f"memory (1 process):        {memory_rate:10.0f} checks/s")
+    print(f"sqlite shared ({args.procs} procs):  {total_checks / wall:10.0f} checks/s")
+    print(f"global admitted: {admitted} (limit {GLOBAL_LIMIT})")
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# bench_startup.py - tempo di avvio del bot (import + sottosistemi)
+#
+#   python benchmarks/bench_startup.py [--runs 5] [--top 10]
+#
+# Ogni misura gira in un processo nuovo, in una cartella temporanea con
+# credenziali finte, così i database e i log partono sempre vuoti. Misura
+# l'import di discord_bot e start_subsystems() (tutto ciò che setup_hook
+# fa prima della connessione al gateway); il login a Discord è escluso.
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import time, json, asyncio
+started = time.perf_counter()
+import discord_bot
+imported = time.perf_counter()
+
+async def main():
+    await discord_bot.start_subsystems()
+    ready = time.perf_counter()
+    await discord_bot.stop_subsystems()
+    return ready
+
+ready = asyncio.run(main())
+print(json.dumps({
+    'import_s': imported - started,
+    'subsystems_s': ready - imported,
+    'total_s': ready - started,
+    'steps': discord_bot.STARTUP_TIMINGS,
+}))
+"""
+
+FAKE_ENV = {
+    'DISCORD_TOKEN': 'bench-token',
+    'GEMINI_API_KEY_1': 'AIza-bench-key',
+    'LOG_LEVEL': 'WARNING',
+    'PORT': '0',
+}
+
+
+def run_probe(cwd):
+    env = dict(os.environ, **FAKE_ENV, PYTHONPATH=ROOT)
+    out = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=cwd, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def import_profile(cwd, top):
+    """Slowest modules (cumulative µs) from ``python -X importtime``."""
+    env = dict(os.environ, **FAKE_ENV, PYTHONPATH=ROOT)
+    out = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import discord_bot'],
+        cwd=cwd, env=env, capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name.startswith(' ' * 3):  # solo import di primo livello
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bot startup time benchmark')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--top', type=int, default=10, help='slowest top-level imports to list')
+    args = parser.parse_args()
+
+    results = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as tmp:
+            results.append(run_probe(tmp))
+    with tempfile.TemporaryDirectory() as tmp:
+        slowest = import_profile(tmp, args.top)
+
+    report = {
+        key: statistics.median(r[key] for r in results)
+        for key in ('import_s', 'subsystems_s', 'total_s')
+    }
+    report['steps'] = {
+        name: statistics.median(r['steps'][name] for r in results) for name in results[0]['steps']
+    }
+    report['runs'] = args.runs
+    report['slowest_imports'] = {name: us / 1e6 for us, name in slowest}
+
+    print(f"import discord_bot:  {report['import_s'] * 1000:8.1f} ms (median of {args.runs})")
+    print(f"start_subsystems():  {report['subsystems_s'] * 1000:8.1f} ms")
+    for name, seconds in report['steps'].items():
+        print(f"  {name:<18} {seconds * 1000:8.1f} ms")
+    print(f"total to pre-login:  {report['total_s'] * 1000:8.1f} ms")
+    print("slowest top-level imports:")
+    for us, name in slowest:
+        print(f"  {name:<30} {us / 1000:8.1f} ms")
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
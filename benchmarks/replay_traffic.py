@@ -0,0 +1,249 @@
+# replay_traffic.py - replay accelerato di una traccia di traffico reale
+#
+#   TRAFFIC_TRACE=trace.jsonl python discord_bot.py        # registrazione (opt-in)
+#   python benchmarks/replay_traffic.py trace.jsonl [--speed 10] [--latency 0.5]
+#                                       [--credits 1000] [--output replay.json]
+#
+# Rimette gli eventi della traccia nella pipeline vera (on_message, comandi,
+# rate limiter, coda AI, invio) con i tempi originali divisi per --speed
+# (1x-50x), contro il backend LLM finto di bench_pipeline.py. Riporta gli
+# esiti per messaggio, i rifiuti dei rate limit, il picco della coda AI e
+# dell'invio, e la linea temporale al secondo per vedere i picchi.
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_pipeline import (
+    FakeChannel, FakeContext, FakeMessage, FakeUser, StubBackend, percentiles
+)
+from traffic import load_trace
+
+MAX_SPEED = 50.0
+
+
+class FakePermissions:
+    send_messages = True
+    read_messages = True
+
+
+class FakeGuildChannel(FakeChannel):
+    def permissions_for(self, member):
+        return FakePermissions()
+
+
+class FakeGuild:
+    def __init__(self, guild_id):
+        self.id = guild_id
+        self.me = object()
+        self.text_channels = []
+
+
+class World:
+    """Stable fake Discord objects for the hashed IDs of a trace."""
+
+    def __init__(self):
+        self.ids = defaultdict(lambda: len(self.ids) + 1)
+        self.guilds = {}
+        self.channels = {}
+        self.users = {}
+
+    def guild(self, key):
+        if key is None:
+            return None
+        if key not in self.guilds:
+            self.guilds[key] = FakeGuild(self.ids[('guild', key)])
+        return self.guilds[key]
+
+    def channel(self, key, guild):
+        if key not in self.channels:
+            cls = FakeGuildChannel if guild else FakeChannel
+            self.channels[key] = cls(self.ids[('channel', key)])
+            if guild:
+                guild.text_channels.append(self.channels[key])
+        return self.channels[key]
+
+    def user(self, key, channel):
+        if key not in self.users:
+            self.users[key] = FakeUser(self.ids[('user', key)], channel)
+        return self.users[key]
+
+
+def synth_content(index, event):
+    """Text with the recorded length (unique, so the cache never hits)."""
+    if event.get('command') is not None:
+        return '!' + event['command']
+    length = event['length']
+    text = f"m{index} " + 'lorem ipsum dolor sit amet ' * (length // 27 + 1)
+    return text[:length]
+
+
+def counter_delta(counter, before):
+    after = counter.snapshot()
+    return {
+        '/'.join(key) or 'total': after[key] - before.get(key, 0)
+        for key in after if after[key] != before.get(key, 0)
+    }
+
+
+async def replay(bot_module, events, args):
+    from metrics import MESSAGES_PROCESSED, RATE_LIMIT_REJECTIONS
+
+    world = World()
+    messages = []
+    for i, event in enumerate(events):
+        guild = world.guild(event.get('guild'))
+        channel = world.channel(event['channel'], guild)
+        user = world.user(event['user'], channel)
+        message = FakeMessage(user, synth_content(i, event), channel)
+        message.guild = guild
+        messages.append(message)
+    for user in world.users.values():
+        await bot_module.credit_service.add(user.id, args.credits)
+
+    skipped_commands = defaultdict(int)
+
+    async def process_commands(message):
+        if not message.content.startswith('!'):
+            return
+        name = message.content[1:].split(maxsplit=1)[0] if len(message.content) > 1 else ''
+        command = bot_module.bot.get_command(name)
+        # Comandi con argomenti: la traccia non li ha, si contano e basta
+        if command is None or command.clean_params:
+            skipped_commands[name or '(empty)'] += 1
+            return
+        ctx = FakeContext(message.author, message.channel)
+        ctx.guild = message.guild
+        await command.callback(ctx)
+    bot_module.bot.process_commands = process_commands
+
+    outcomes_before = MESSAGES_PROCESSED.snapshot()
+    rejections_before = RATE_LIMIT_REJECTIONS.snapshot()
+    timeline = defaultdict(lambda: {'events': 0, 'ai_queue_depth': 0, 'ai_active': 0, 'outbound_queued': 0})
+    peaks = defaultdict(int)
+    lateness = []
+    latencies = []
+    done = asyncio.Event()
+
+    async def sample():
+        while not done.is_set():
+            second = int((time.perf_counter() - started) * args.speed)
+            point = timeline[second]
+            for name, value in (
+                ('ai_queue_depth', bot_module.ai_scheduler.depth),
+                ('ai_active', bot_module.ai_scheduler.active),
+                ('outbound_queued', sum(len(q) for q in bot_module.outbound.queues.values())),
+            ):
+                point[name] = max(point[name], value)
+                peaks[name] = max(peaks[name], value)
+            await asyncio.sleep(0.05)
+
+    async def deliver(message):
+        begun = time.perf_counter()
+        await bot_module.on_message(message)
+        latencies.append(time.perf_counter() - begun)
+
+    t0 = events[0]['t']
+    started = time.perf_counter()
+    sampler = asyncio.create_task(sample())
+    tasks = []
+    for event, message in zip(events, messages):
+        due = (event['t'] - t0) / args.speed
+        wait = due - (time.perf_counter() - started)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        lateness.append(max(0.0, -wait))
+        timeline[int(event['t'] - t0)]['events'] += 1
+        tasks.append(asyncio.create_task(deliver(message)))
+    await asyncio.gather(*tasks)
+    wall = time.perf_counter() - started
+    done.set()
+    await sampler
+
+    return {
+        'events': len(events),
+        'trace_span_s': events[-1]['t'] - t0,
+        'speed': args.speed,
+        'wall_s': wall,
+        'events_per_s': len(events) / wall if wall else 0.0,
+        'users': len(world.users),
+        'guilds': len(world.guilds),
+        'channels': len(world.channels),
+        'outcomes': counter_delta(MESSAGES_PROCESSED, outcomes_before),
+        'rate_limit_rejections': counter_delta(RATE_LIMIT_REJECTIONS, rejections_before),
+        'skipped_commands': dict(skipped_commands),
+        'on_message': percentiles(latencies),
+        'schedule_lateness': percentiles(lateness),
+        'peaks': dict(peaks),
+        'ai_queue': bot_module.ai_scheduler.stats(),
+        'outbound': bot_module.outbound.stats(),
+        'upstream_calls': bot_module.ai_backend.calls,
+        'timeline': [{'second': s, **timeline[s]} for s in sorted(timeline)],
+    }
+
+
+async def run(args, events):
+    import discord_bot
+
+    backend = StubBackend(args.latency, args.jitter)
+    discord_bot.ai_backend = discord_bot.ai_gateway.backend = backend
+    discord_bot.STREAM_RESPONSES = args.stream
+    await discord_bot.start_subsystems()
+    try:
+        return await replay(discord_bot, events, args)
+    finally:
+        await discord_bot.stop_subsystems()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a recorded traffic trace against the stub backend')
+    parser.add_argument('trace', help='JSONL trace written with TRAFFIC_TRACE')
+    parser.add_argument('--speed', type=float, default=1.0, help=f'time compression, 1-{MAX_SPEED:.0f}x')
+    parser.add_argument('--latency', type=float, default=0.5, help='stub model latency (s)')
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--stream', action='store_true', help='use the streaming reply path')
+    parser.add_argument('--credits', type=int, default=1000, help='credits granted to every replayed user')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+    if not 1.0 <= args.speed <= MAX_SPEED:
+        parser.error(f"--speed must be between 1 and {MAX_SPEED:.0f}")
+
+    events = load_trace(args.trace)
+    if not events:
+        parser.error("empty trace")
+    output = os.path.abspath(args.output) if args.output else None
+
+    os.chdir(tempfile.mkdtemp(prefix='replay_traffic_'))
+    os.environ.update({
+        'DISCORD_TOKEN': 'replay-token',
+        'GEMINI_API_KEY_1': 'AIza-replay-key',
+        'LOG_LEVEL': 'WARNING',
+        'PORT': '0',
+    })
+    os.environ.pop('TRAFFIC_TRACE', None)
+
+    report = asyncio.run(run(args, events))
+    report['config'] = vars(args)
+
+    print(f"{report['events']} events over {report['trace_span_s']:.1f}s replayed at {args.speed:g}x "
+          f"in {report['wall_s']:.1f}s ({report['events_per_s']:.1f} ev/s)")
+    print(f"outcomes:   {report['outcomes']}")
+    print(f"rejections: {report['rate_limit_rejections']}")
+    print(f"peaks:      {report['peaks']}  (AI queue shed: {report['ai_queue']['shed']})")
+    lag = report['schedule_lateness']
+    if lag['count']:
+        print(f"replay lag: p95 {lag['p95'] * 1000:.1f} ms, p99 {lag['p99'] * 1000:.1f} ms")
+    if output:
+        with open(output, 'w') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+# bounded_state.py - STATO PER-UTENTE CON SCADENZA (TTL + LRU)
+import sys
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+
+class ExpiringDict:
+    """Mapping whose entries expire ``ttl`` seconds after their last access
+    and which never holds more than ``maxsize`` entries (least recently
+    used are evicted first).
+
+    Entries are kept in an ``OrderedDict`` in access order; since the TTL
+    is the same for every key this is also expiry order, so purging only
+    ever looks at the expired prefix. With ``refresh_on_read=False`` the
+    TTL counts from the last write instead (a bound on staleness, for
+    caches); access order then no longer matches expiry order and purging
+    scans every entry.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, maxsize: Optional[int] = None,
+                 clock: Callable[[], float] = time.monotonic, refresh_on_read: bool = True):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self.refresh_on_read = refresh_on_read
+        # key -> [expires_at, value]
+        self._data: 'OrderedDict[Hashable, list]' = OrderedDict()
+
+    def _deadline(self) -> float:
+        return self.clock() + self.ttl if self.ttl is not None else float('inf')
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        if entry[0] <= self.clock():
+            del self._data[key]
+            return _MISSING
+        if self.refresh_on_read:
+            entry[0] = self._deadline()
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def get(self, key, default=None):
+        value = self._lookup(key)
+        return default if value is _MISSING else value
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        entry = self._data.get(key)
+        if entry is not None:
+            entry[0] = self._deadline()
+            entry[1] = value
+            self._data.move_to_end(key)
+            return
+        self._data[key] = [self._deadline(), value]
+        if self.maxsize is not None and len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def setdefault(self, key, default=None):
+        value = self._lookup(key)
+        if value is _MISSING:
+            self[key] = value = default
+        return value
+
+    def __contains__(self, key) -> bool:
+        return self._lookup(key) is not _MISSING
+
+    def __delitem__(self, key):
+        del self._data[key]
+
+    def pop(self, key, default=None):
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __iter__(self) -> Iterator:
+        return iter(list(self._data))
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        for key, entry in list(self._data.items()):
+            yield key, entry[1]
+
+    def purge_expired(self) -> int:
+        """Drop every expired entry; returns how many were removed."""
+        now = self.clock()
+        removed = 0
+        data = self._data
+        if not self.refresh_on_read:
+            expired = [key for key, entry in data.items() if entry[0] <= now]
+            for key in expired:
+                del data[key]
+            return len(expired)
+        while data:
+            key, entry = next(iter(data.items()))
+            if entry[0] > now:
+                break
+            del data[key]
+            removed += 1
+        return removed
+
+    def approx_bytes(self, sample: int = 1000) -> int:
+        """Approximate footprint: container plus a sampled, one-level-deep
+        size of keys and values, extrapolated to all entries."""
+        total = sys.getsizeof(self._data)
+        if not self._data:
+            return total
+        measured = 0
+        count = 0
+        for key, entry in self._data.items():
+            measured += sys.getsizeof(key) + sys.getsizeof(entry) + _shallow_size(entry[1])
+            count += 1
+            if count >= sample:
+                break
+        return total + measured * len(self._data) // count
+
+
+def _shallow_size(value) -> int:
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset, deque)):
+        size += sum(sys.getsizeof(v) for v in value)
+    return size
+
+
+# ==================== JANITOR ====================
+class StateJanitor:
+    """Periodically purges expired entries from registered containers and
+    produces a memory report per structure."""
+
+    def __init__(self, interval: float = 60.0):
+        self.interval = interval
+        self.containers: Dict[str, ExpiringDict] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, name: str, container: ExpiringDict) -> ExpiringDict:
+        self.containers[name] = container
+        return container
+
+    def sweep(self) -> int:
+        removed = 0
+        for container in self.containers.values():
+            removed += container.purge_expired()
+        return removed
+
+    def memory_report(self) -> Dict[str, Dict[str, int]]:
+        return {
+            name: {'entries': len(container), 'approx_bytes': container.approx_bytes()}
+            for name, container in self.containers.items()
+        }
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                removed = self.sweep()
+                if removed:
+                    logger.debug(f"🧹 Janitor: rimosse {removed} voci scadute")
+            except Exception as e:
+                logger.error(f"❌ Errore janitor: {e}")
@@ -0,0 +1,78 @@
+# coalescing.py - RICHIESTE AI IDENTICHE IN VOLO CONDIVIDONO UNA CHIAMATA
+import asyncio
+import logging
+from typing import Dict, Hashable, Optional
+
+from metrics import AI_COALESCED
+
+logger = logging.getLogger(__name__)
+
+
+class RequestCoalescer:
+    """Single-flight registry for AI generations.
+
+    The first request for a key ``lead``s: it makes the upstream call and
+    ``finish``es with the text (or ``None`` on failure). Identical requests
+    arriving meanwhile ``follow`` and await that same result instead of
+    calling upstream; each follower is one saved call.
+
+    Only upstream outcomes are shared. A leader that gives up before
+    calling (shed by the queue, no API key, cancelled) ``abandon``s
+    instead: followers get ``ABANDONED`` and start over, so the first of
+    them leads a new flight and the rest follow it.
+    """
+
+    ABANDONED = object()
+
+    def __init__(self):
+        self.flights: Dict[Hashable, asyncio.Future] = {}
+        self.followers: Dict[Hashable, int] = {}
+        self.total_led = 0
+        self.total_coalesced = 0
+        self.total_shared_calls = 0
+
+    def follow(self, key: Optional[Hashable]) -> Optional[asyncio.Future]:
+        """The in-flight result for ``key``, or ``None`` if there is none
+        (the caller should then ``lead``)."""
+        if key is None:
+            return None
+        flight = self.flights.get(key)
+        if flight is None:
+            return None
+        self.followers[key] += 1
+        return flight
+
+    def lead(self, key: Optional[Hashable]):
+        if key is None:
+            return
+        self.flights[key] = asyncio.get_running_loop().create_future()
+        self.followers[key] = 0
+        self.total_led += 1
+
+    def finish(self, key: Optional[Hashable], text: Optional[str]):
+        flight = self.flights.pop(key, None) if key is not None else None
+        if flight is None:
+            return
+        followers = self.followers.pop(key)
+        if followers:
+            # Contati qui: un follower di un volo abbandonato non ha risparmiato nulla
+            self.total_shared_calls += 1
+            self.total_coalesced += followers
+            AI_COALESCED.inc(followers)
+        flight.set_result(text)
+
+    def abandon(self, key: Optional[Hashable]):
+        """End ``key``'s flight without an upstream outcome."""
+        flight = self.flights.pop(key, None) if key is not None else None
+        if flight is None:
+            return
+        self.followers.pop(key)
+        flight.set_result(self.ABANDONED)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'in_flight': len(self.flights),
+            'led': self.total_led,
+            'coalesced': self.total_coalesced,
+            'shared_calls': self.total_shared_calls,
+        }
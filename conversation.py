@@ -0,0 +1,132 @@
+# conversation.py - MEMORIA DELLE CONVERSAZIONI PER UTENTE (BUDGET TOKEN)
+import sys
+import time
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Hashable, List, Optional, Tuple
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token for Gemini on mixed
+    text); good enough for budgeting, no tokenizer needed."""
+    return max(1, (len(text) + 3) // 4)
+
+
+class Conversation:
+    __slots__ = ('turns', 'tokens', 'expires_at')
+
+    def __init__(self):
+        # (ruolo, testo, token)
+        self.turns: Deque[Tuple[str, str, int]] = deque()
+        self.tokens = 0
+        self.expires_at = 0.0
+
+
+class ConversationMemory:
+    """Recent turns per conversation key, bounded three ways.
+
+    Each conversation keeps at most ``token_budget`` tokens; the oldest
+    turns are dropped first. Conversations idle for ``ttl`` seconds
+    expire, and when all conversations together exceed ``total_tokens``
+    (or ``maxsize`` conversations) the least recently used are evicted whole.
+    Implements ``purge_expired``/``approx_bytes`` so the ``StateJanitor``
+    can sweep and report it like an ``ExpiringDict``. The bot keys it by
+    ``(user_id, channel_id)`` so turns never leak from one channel (a
+    DM) into another (a public guild channel). Memory is per process.
+    """
+
+    def __init__(self, token_budget: int = 2000, total_tokens: int = 5_000_000,
+                 ttl: Optional[float] = 3600, maxsize: Optional[int] = None,
+                 clock: Callable[[], float] = time.monotonic):
+        self.token_budget = token_budget
+        self.total_tokens = total_tokens
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.clock = clock
+        self.tokens = 0
+        # Ordine d'uso: il primo è il meno recente (e il primo a scadere)
+        self._conversations: 'OrderedDict[Hashable, Conversation]' = OrderedDict()
+
+    def _touch(self, key, conversation: Conversation):
+        conversation.expires_at = self.clock() + self.ttl if self.ttl is not None else float('inf')
+        self._conversations.move_to_end(key)
+
+    def _live(self, key) -> Optional[Conversation]:
+        conversation = self._conversations.get(key)
+        if conversation is not None and conversation.expires_at <= self.clock():
+            self._evict(key)
+            return None
+        return conversation
+
+    def _evict(self, key):
+        conversation = self._conversations.pop(key)
+        self.tokens -= conversation.tokens
+
+    def history(self, key) -> List[Tuple[str, str]]:
+        """``(role, text)`` turns, oldest first."""
+        conversation = self._live(key)
+        if conversation is None:
+            return []
+        self._touch(key, conversation)
+        return [(role, text) for role, text, _ in conversation.turns]
+
+    def transcript(self, key, labels=(('user', 'User'), ('model', 'Assistant'))) -> str:
+        """History rendered as prompt text, ending with a blank line (or
+        ``''`` when there is none)."""
+        names = dict(labels)
+        return ''.join(f"{names.get(role, role)}: {text}\n\n" for role, text in self.history(key))
+
+    def append(self, key, role: str, text: str):
+        conversation = self._live(key)
+        if conversation is None:
+            conversation = self._conversations[key] = Conversation()
+        self._touch(key, conversation)
+
+        tokens = estimate_tokens(text)
+        if tokens > self.token_budget:
+            # Un turno da solo sfora il budget: se ne tiene l'inizio
+            text = text[:self.token_budget * 4 - 1] + '…'
+            tokens = estimate_tokens(text)
+        conversation.turns.append((role, text, tokens))
+        conversation.tokens += tokens
+        self.tokens += tokens
+        while conversation.tokens > self.token_budget:
+            _, _, dropped = conversation.turns.popleft()
+            conversation.tokens -= dropped
+            self.tokens -= dropped
+
+        while self._conversations and (
+            self.tokens > self.total_tokens
+            or (self.maxsize is not None and len(self._conversations) > self.maxsize)
+        ):
+            oldest = next(iter(self._conversations))
+            if oldest == key and len(self._conversations) == 1:
+                break
+            self._evict(oldest)
+
+    def reset(self, key) -> bool:
+        """Forget ``key``'s conversation; False if there was none."""
+        if self._live(key) is None:
+            return False
+        self._evict(key)
+        return True
+
+    def __len__(self) -> int:
+        return len(self._conversations)
+
+    def purge_expired(self) -> int:
+        now = self.clock()
+        removed = 0
+        while self._conversations:
+            key, conversation = next(iter(self._conversations.items()))
+            if conversation.expires_at > now:
+                break
+            self._evict(key)
+            removed += 1
+        return removed
+
+    def approx_bytes(self) -> int:
+        total = sys.getsizeof(self._conversations)
+        for conversation in self._conversations.values():
+            total += sys.getsizeof(conversation) + sys.getsizeof(conversation.turns)
+            total += sum(sys.getsizeof(text) + 64 for _, text, _ in conversation.turns)
+        return total
@@ -0,0 +1,205 @@
+# credit_service.py - API ASINCRONA PER I CREDITI
+import asyncio
+import itertools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Set, Tuple
+
+from credit_store import CreditStore
+from metrics import CREDIT_REFUNDS, CREDIT_STORE_LATENCY, CREDIT_UNBILLED
+
+logger = logging.getLogger(__name__)
+
+
+class Reservation:
+    """A hold on ``amount`` credits, created by ``CreditService.reserve``.
+
+    ``charged`` is the balance after the up-front deduction made for
+    shared stores, ``None`` for in-memory holds.
+    """
+
+    __slots__ = ('id', 'user_id', 'amount', 'charged', '_timer')
+
+    def __init__(self, hold_id: int, user_id: int, amount: int, charged: Optional[int] = None):
+        self.id = hold_id
+        self.user_id = user_id
+        self.amount = amount
+        self.charged = charged
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+
+class CreditService:
+    """Awaitable front-end for a ``CreditStore``.
+
+    Storage calls run on a small dedicated thread pool so disk I/O never
+    blocks the Discord event loop. Mutations for the same user are
+    serialized with a per-user ``asyncio.Lock``; different users proceed
+    in parallel. Locks are dropped as soon as nobody holds or awaits them.
+
+    Paid requests use two-phase reservations: ``reserve`` places an
+    in-memory hold, ``commit`` turns it into a single durable deduction and
+    ``release`` (or expiry after ``hold_ttl`` seconds) drops it without any
+    I/O. A crash while a hold is open charges nothing. Requests that may
+    outlive ``hold_ttl`` (queued, streaming) ``extend`` their hold; it
+    still lapses if the request gets stuck.
+
+    In-memory holds only exist in this process. With ``shared=True`` (a
+    store written by several processes, e.g. one per shard) ``reserve``
+    deducts up front in the store's own transaction, ``commit`` just
+    keeps the charge and ``release``/expiry refund it in the background,
+    so two processes can never hold the same credits (a crash while such
+    a hold is open keeps the charge).
+    """
+
+    def __init__(self, store: CreditStore, max_workers: int = 4, hold_ttl: float = 120.0,
+                 shared: bool = False):
+        self.store = store
+        self.hold_ttl = hold_ttl
+        self.shared = shared
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='credits')
+        # user_id -> [lock, holders + waiters]
+        self._locks: Dict[int, List] = {}
+        self._holds: Dict[int, Reservation] = {}
+        self._held: Dict[int, int] = {}
+        self._hold_ids = itertools.count(1)
+        self._refunds: Set[asyncio.Task] = set()
+        self._closed = False
+
+    async def _run(self, fn, *args):
+        def timed():
+            with CREDIT_STORE_LATENCY.time(op=fn.__name__):
+                return fn(*args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, timed)
+
+    @asynccontextmanager
+    async def user_lock(self, user_id: int):
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[user_id]
+
+    async def get(self, user_id: int) -> int:
+        return await self._run(self.store.get, user_id)
+
+    async def add(self, user_id: int, amount: int) -> int:
+        async with self.user_lock(user_id):
+            return await self._run(self.store.add, user_id, amount)
+
+    async def deduct(self, user_id: int, amount: int) -> Tuple[bool, int]:
+        async with self.user_lock(user_id):
+            return await self._run(self.store.deduct, user_id, amount)
+
+    # ---------- prenotazioni ----------
+    async def reserve(self, user_id: int, amount: int) -> Tuple[Optional[Reservation], int]:
+        """Hold ``amount`` credits if the unheld balance covers it.
+
+        Returns ``(reservation, available_before)``; the reservation is
+        ``None`` when there are not enough credits.
+        """
+        async with self.user_lock(user_id):
+            if self.shared:
+                ok, balance = await self._run(self.store.deduct, user_id, amount)
+                if not ok:
+                    return None, balance
+                hold = Reservation(next(self._hold_ids), user_id, amount, charged=balance)
+                available = balance + amount
+            else:
+                balance = await self._run(self.store.get, user_id)
+                available = balance - self._held.get(user_id, 0)
+                if available < amount:
+                    return None, available
+                hold = Reservation(next(self._hold_ids), user_id, amount)
+                self._held[user_id] = self._held.get(user_id, 0) + amount
+
+            hold._timer = asyncio.get_running_loop().call_later(self.hold_ttl, self._expire, hold)
+            self._holds[hold.id] = hold
+            return hold, available
+
+    def extend(self, hold: Reservation, ttl: float):
+        """Re-arm ``hold`` to expire ``ttl`` seconds from now. No-op if it
+        was already committed, released or expired."""
+        if hold.id not in self._holds:
+            return
+        if hold._timer is not None:
+            hold._timer.cancel()
+        hold._timer = asyncio.get_running_loop().call_later(ttl, self._expire, hold)
+
+    def _drop(self, hold: Reservation) -> bool:
+        if self._holds.pop(hold.id, None) is None:
+            return False
+        if hold._timer is not None:
+            hold._timer.cancel()
+        if hold.charged is not None:
+            return True
+        remaining = self._held[hold.user_id] - hold.amount
+        if remaining:
+            self._held[hold.user_id] = remaining
+        else:
+            del self._held[hold.user_id]
+        return True
+
+    def _refund(self, hold: Reservation):
+        # Prenotazione già addebitata nello store condiviso: si restituisce
+        if hold.charged is None:
+            return
+        task = asyncio.get_running_loop().create_task(self.add(hold.user_id, hold.amount))
+        self._refunds.add(task)
+        task.add_done_callback(self._refund_done)
+
+    def _refund_done(self, task: asyncio.Task):
+        self._refunds.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"❌ Rimborso prenotazione fallito: {task.exception()}")
+
+    def _expire(self, hold: Reservation):
+        if self._drop(hold):
+            self._refund(hold)
+            CREDIT_REFUNDS.inc(reason='expired')
+            logger.warning(f"⌛ Prenotazione {hold.id} scaduta per utente {hold.user_id}")
+
+    def release(self, hold: Reservation):
+        """Drop a hold without charging. No-op if already committed/released."""
+        if self._drop(hold):
+            self._refund(hold)
+            CREDIT_REFUNDS.inc(reason='released')
+
+    async def commit(self, hold: Reservation) -> Tuple[bool, int]:
+        """Charge a hold with one durable deduction.
+
+        Returns ``(False, balance)`` when the hold had already lapsed and
+        the credits were spent meanwhile: the reply went out unbilled.
+        """
+        async with self.user_lock(hold.user_id):
+            if self._drop(hold) and hold.charged is not None:
+                return True, hold.charged
+            charged, balance = await self._run(self.store.deduct, hold.user_id, hold.amount)
+            if not charged:
+                CREDIT_UNBILLED.inc()
+            return charged, balance
+
+    def held(self, user_id: int) -> int:
+        return self._held.get(user_id, 0)
+
+    async def stats(self) -> Tuple[int, int]:
+        return await self._run(self.store.stats)
+
+    async def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        # Le prenotazioni ancora aperte non verranno più addebitate
+        for hold in list(self._holds.values()):
+            self.release(hold)
+        if self._refunds:
+            await asyncio.gather(*self._refunds, return_exceptions=True)
+        await self._run(self.store.close)
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,501 @@
+# credit_store.py - BACKEND DI PERSISTENZA PER I CREDITI UTENTE
+import os
+import json
+import sqlite3
+import threading
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Crediti assegnati a un utente mai visto prima
+DEFAULT_CREDITS = 4
+
+
+# ==================== INTERFACCIA ====================
+class CreditStore:
+    """Common interface for credit backends.
+
+    Balances are integers keyed by Discord user ID. A user with no record
+    has ``DEFAULT_CREDITS``; records are only materialized on mutation.
+    """
+
+    def get(self, user_id: int) -> int:
+        raise NotImplementedError
+
+    def add(self, user_id: int, amount: int) -> int:
+        """Add ``amount`` (may be negative) and return the new balance."""
+        raise NotImplementedError
+
+    def deduct(self, user_id: int, amount: int) -> Tuple[bool, int]:
+        """Atomically subtract ``amount`` if the balance covers it.
+
+        Returns ``(True, new_balance)`` on success and
+        ``(False, current_balance)`` otherwise.
+        """
+        raise NotImplementedError
+
+    def stats(self) -> Tuple[int, int]:
+        """Return ``(users, total_credits)`` over materialized records."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+# ==================== BACKEND JSON (LEGACY) ====================
+class JsonCreditStore(CreditStore):
+    """The original single-file backend: every call re-reads the file and
+    every mutation rewrites it. Kept for compatibility and benchmarks."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def _load(self) -> Dict[str, int]:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, data: Dict[str, int]):
+        with open(self.path, 'w') as f:
+            json.dump(data, f)
+
+    def get(self, user_id: int) -> int:
+        return self._load().get(str(user_id), DEFAULT_CREDITS)
+
+    def add(self, user_id: int, amount: int) -> int:
+        with self.lock:
+            data = self._load()
+            key = str(user_id)
+            data[key] = data.get(key, DEFAULT_CREDITS) + amount
+            self._save(data)
+            return data[key]
+
+    def deduct(self, user_id: int, amount: int) -> Tuple[bool, int]:
+        with self.lock:
+            data = self._load()
+            key = str(user_id)
+            current = data.get(key, DEFAULT_CREDITS)
+            if current < amount:
+                return False, current
+            data[key] = current - amount
+            self._save(data)
+            return True, data[key]
+
+    def stats(self) -> Tuple[int, int]:
+        data = self._load()
+        return len(data), sum(data.values())
+
+
+# ==================== BACKEND SQLITE (WAL) ====================
+class SQLiteCreditStore(CreditStore):
+    """Embedded transactional ledger.
+
+    Lookups hit the primary key index, mutations run inside a single
+    ``BEGIN IMMEDIATE`` transaction so concurrent writers (threads or
+    processes) can never lose each other's updates. Each thread gets its
+    own connection; WAL lets readers proceed while a writer commits.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS credits (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str, synchronous: str = 'NORMAL'):
+        self.path = path
+        self.synchronous = synchronous
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        logger.info(f"💾 Ledger crediti SQLite pronto: {path}")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA synchronous={self.synchronous}')
+            self._local.conn = conn
+        return conn
+
+    def get(self, user_id: int) -> int:
+        row = self._conn().execute(
+            'SELECT balance FROM credits WHERE user_id = ?', (user_id,)
+        ).fetchone()
+        return row[0] if row else DEFAULT_CREDITS
+
+    def add(self, user_id: int, amount: int) -> int:
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT INTO credits (user_id, balance) VALUES (?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET balance = balance + ?',
+                (user_id, DEFAULT_CREDITS + amount, amount)
+            )
+            balance = conn.execute(
+                'SELECT balance FROM credits WHERE user_id = ?', (user_id,)
+            ).fetchone()[0]
+            conn.execute('COMMIT')
+            return balance
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def deduct(self, user_id: int, amount: int) -> Tuple[bool, int]:
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            cur = conn.execute(
+                'UPDATE credits SET balance = balance - ? '
+                'WHERE user_id = ? AND balance >= ?',
+                (amount, user_id, amount)
+            )
+            if cur.rowcount:
+                balance = conn.execute(
+                    'SELECT balance FROM credits WHERE user_id = ?', (user_id,)
+                ).fetchone()[0]
+                conn.execute('COMMIT')
+                return True, balance
+
+            row = conn.execute(
+                'SELECT balance FROM credits WHERE user_id = ?', (user_id,)
+            ).fetchone()
+            if row is None and DEFAULT_CREDITS >= amount:
+                conn.execute(
+                    'INSERT INTO credits (user_id, balance) VALUES (?, ?)',
+                    (user_id, DEFAULT_CREDITS - amount)
+                )
+                conn.execute('COMMIT')
+                return True, DEFAULT_CREDITS - amount
+
+            conn.execute('ROLLBACK')
+            return False, row[0] if row else DEFAULT_CREDITS
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def stats(self) -> Tuple[int, int]:
+        users, total = self._conn().execute(
+            'SELECT COUNT(*), COALESCE(SUM(balance), 0) FROM credits'
+        ).fetchone()
+        return users, total
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn().execute(
+            'SELECT value FROM meta WHERE key = ?', (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def import_balances(self, balances: Dict[int, int], meta_key: Optional[str] = None):
+        """Bulk upsert in one transaction, optionally recording ``meta_key``."""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                'INSERT INTO credits (user_id, balance) VALUES (?, ?) '
+                'ON CONFLICT(user_id) DO UPDATE SET balance = excluded.balance',
+                list(balances.items())
+            )
+            if meta_key:
+                conn.execute(
+                    'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+                    (meta_key, '1')
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+# ==================== BACKEND IN MEMORIA + JOURNAL ====================
+class JournalCreditStore(CreditStore):
+    """Write-back in-memory balance table.
+
+    Reads are served from a dict. Each mutation appends ``seq user balance``
+    to an append-only journal and only returns once a background flusher
+    has fsynced the batch containing it, so every acknowledged mutation
+    survives a crash. Concurrent writers share one fsync (group commit).
+
+    Every ``snapshot_every`` records the journal is rotated and a compacted
+    snapshot is written, which keeps startup replay bounded.
+    """
+
+    SNAPSHOT = 'credits.snapshot'
+    JOURNAL = 'credits.journal'
+    OLD_JOURNAL = 'credits.journal.old'
+
+    def __init__(self, directory: str, snapshot_every: int = 50000):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+
+        self.balances: Dict[int, int] = {}
+        self.meta: Dict[str, str] = {}
+        self.seq = 0
+        self.durable_seq = 0
+        self._pending = []
+        self._since_snapshot = 0
+        self._snapshot_thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        self._stopping = False
+        self._cond = threading.Condition()
+
+        replayed = self._recover()
+        self._journal = open(self._path(self.JOURNAL), 'ab')
+        self._flusher = threading.Thread(target=self._flush_loop, name='credit-journal', daemon=True)
+        self._flusher.start()
+        logger.info(
+            f"💾 Journal crediti pronto: {len(self.balances)} utenti, {replayed} record rigiocati"
+        )
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    # ---------- recovery ----------
+    def _recover(self) -> int:
+        try:
+            with open(self._path(self.SNAPSHOT), 'r') as f:
+                snap = json.load(f)
+            self.seq = snap['seq']
+            self.meta = snap.get('meta', {})
+            self.balances = {int(k): v for k, v in snap['balances'].items()}
+        except FileNotFoundError:
+            pass
+
+        replayed = 0
+        for name in (self.OLD_JOURNAL, self.JOURNAL):
+            replayed += self._replay(self._path(name))
+
+        # Compact right away: startup never replays the same records twice
+        # and a torn tail left by a crash is discarded with the old journal.
+        self.durable_seq = self.seq
+        self._write_snapshot(dict(self.balances), self.seq, dict(self.meta))
+        for name in (self.OLD_JOURNAL, self.JOURNAL):
+            try:
+                os.remove(self._path(name))
+            except FileNotFoundError:
+                pass
+        return replayed
+
+    def _replay(self, path: str) -> int:
+        count = 0
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return 0
+        with f:
+            for line in f:
+                parts = line.split()
+                if len(parts) != 3 or not line.endswith(b'\n'):
+                    logger.warning(f"⚠️ Journal troncato in {path}, record finale ignorato")
+                    break
+                seq, user_id, balance = (int(x) for x in parts)
+                if seq <= self.seq:
+                    continue
+                self.balances[user_id] = balance
+                self.seq = seq
+                count += 1
+        return count
+
+    def _write_snapshot(self, balances: Dict[int, int], seq: int, meta: Dict[str, str]):
+        tmp = self._path(f"{self.SNAPSHOT}.{threading.get_ident()}.tmp")
+        with open(tmp, 'w') as f:
+            json.dump({'seq': seq, 'meta': meta, 'balances': balances}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(self.SNAPSHOT))
+        if hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    # ---------- group commit ----------
+    def _append(self, user_id: int, balance: int) -> int:
+        # Chiamato con self._cond acquisito
+        if self._error is not None:
+            raise RuntimeError("Journal crediti non disponibile") from self._error
+        self.seq += 1
+        self._pending.append(f"{self.seq} {user_id} {balance}\n".encode())
+        self._cond.notify_all()
+        return self.seq
+
+    def _wait_durable(self, seq: int):
+        # Chiamato con self._cond acquisito
+        while self.durable_seq < seq:
+            if self._error is not None:
+                raise RuntimeError("Journal crediti non disponibile") from self._error
+            self._cond.wait()
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._stopping:
+                    self._cond.wait()
+                if not self._pending and self._stopping:
+                    return
+                batch, self._pending = self._pending, []
+                last_seq = self.seq
+
+            try:
+                self._journal.write(b''.join(batch))
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            except BaseException as e:
+                logger.critical(f"❌ Scrittura journal crediti fallita: {e}")
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                return
+
+            with self._cond:
+                self.durable_seq = last_seq
+                self._since_snapshot += len(batch)
+                self._cond.notify_all()
+
+            if self._since_snapshot >= self.snapshot_every:
+                self._start_snapshot()
+
+    def _start_snapshot(self):
+        if self._snapshot_thread is not None and self._snapshot_thread.is_alive():
+            return
+        with self._cond:
+            if os.path.exists(self._path(self.OLD_JOURNAL)):
+                # A previous snapshot failed and the old journal is the only
+                # durable copy of its records: never overwrite it. Retry the
+                # snapshot without rotating; it covers both journals, and the
+                # current one is rotated next time.
+                pass
+            else:
+                # Everything in the current journal is durable here; rotate it
+                # so the snapshot covers exactly the records up to ``snap_seq``.
+                self._journal.close()
+                os.replace(self._path(self.JOURNAL), self._path(self.OLD_JOURNAL))
+                self._journal = open(self._path(self.JOURNAL), 'ab')
+            snap = (dict(self.balances), self.durable_seq, dict(self.meta))
+            self._since_snapshot = 0
+        self._snapshot_thread = threading.Thread(
+            target=self._snapshot_worker, args=snap, name='credit-snapshot', daemon=True
+        )
+        self._snapshot_thread.start()
+
+    def _snapshot_worker(self, balances, seq, meta):
+        try:
+            self._write_snapshot(balances, seq, meta)
+            os.remove(self._path(self.OLD_JOURNAL))
+            logger.debug(f"📸 Snapshot crediti scritto (seq {seq}, {len(balances)} utenti)")
+        except Exception as e:
+            logger.error(f"❌ Snapshot crediti fallito: {e}")
+
+    # ---------- API ----------
+    def get(self, user_id: int) -> int:
+        return self.balances.get(user_id, DEFAULT_CREDITS)
+
+    def add(self, user_id: int, amount: int) -> int:
+        with self._cond:
+            balance = self.balances.get(user_id, DEFAULT_CREDITS) + amount
+            self.balances[user_id] = balance
+            self._wait_durable(self._append(user_id, balance))
+            return balance
+
+    def deduct(self, user_id: int, amount: int) -> Tuple[bool, int]:
+        with self._cond:
+            current = self.balances.get(user_id, DEFAULT_CREDITS)
+            if current < amount:
+                return False, current
+            balance = current - amount
+            self.balances[user_id] = balance
+            self._wait_durable(self._append(user_id, balance))
+            return True, balance
+
+    def stats(self) -> Tuple[int, int]:
+        with self._cond:
+            return len(self.balances), sum(self.balances.values())
+
+    def get_meta(self, key: str) -> Optional[str]:
+        return self.meta.get(key)
+
+    def import_balances(self, balances: Dict[int, int], meta_key: Optional[str] = None):
+        with self._cond:
+            for user_id, balance in balances.items():
+                self.balances[user_id] = balance
+                last = self._append(user_id, balance)
+            if meta_key:
+                self.meta[meta_key] = '1'
+            if balances:
+                self._wait_durable(last)
+            # Meta lives only in snapshots: persist it together with the import
+            self._write_snapshot(dict(self.balances), self.durable_seq, dict(self.meta))
+
+    def close(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._flusher.join()
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join()
+        self._journal.close()
+
+
+# ==================== MIGRAZIONE ====================
+def migrate_legacy_json(json_path: str, store: CreditStore) -> int:
+    """One-shot import of the legacy ``user_credits.json`` file.
+
+    The import and the "done" marker are persisted together by the store's
+    ``import_balances``, then the JSON file is renamed to ``<name>.migrated`` so it is never
+    imported twice. Returns the number of imported users.
+    """
+    if store.get_meta('migrated_from_json') or not os.path.exists(json_path):
+        return 0
+
+    try:
+        with open(json_path, 'r') as f:
+            raw = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"❌ Migrazione crediti fallita, file illeggibile: {e}")
+        return 0
+
+    balances = {}
+    for key, value in raw.items():
+        try:
+            balances[int(key)] = int(value)
+        except (TypeError, ValueError):
+            logger.warning(f"⚠️ Record crediti ignorato: {key!r}={value!r}")
+
+    store.import_balances(balances, meta_key='migrated_from_json')
+    os.replace(json_path, json_path + '.migrated')
+    logger.info(f"📦 Migrati {len(balances)} utenti da {json_path}")
+    return len(balances)
+
+
+def create_credit_store(backend: str, path: str, legacy_json: Optional[str] = None) -> CreditStore:
+    """Build the configured backend (``sqlite``, ``journal`` or ``json``)."""
+    if backend == 'json':
+        return JsonCreditStore(legacy_json or path)
+    if backend == 'sqlite':
+        store = SQLiteCreditStore(path)
+    elif backend == 'journal':
+        store = JournalCreditStore(path)
+    else:
+        raise ValueError(f"Backend crediti sconosciuto: {backend}")
+    if legacy_json:
+        migrate_legacy_json(legacy_json, store)
+    return store
@@ -0,0 +1,78 @@
+# formatting.py - DIVISIONE DELLE RISPOSTE RISPETTANDO IL MARKDOWN
+import re
+from typing import List, Optional, Tuple
+
+# Limite Discord per messaggio
+DISCORD_LIMIT = 2000
+FENCE = '```'
+# Solo una parola breve dopo ``` è un linguaggio; il resto è codice sulla stessa riga
+LANG_TAG = re.compile(r'[\w+#.-]{0,20}')
+
+
+def _open_fence(text: str) -> Optional[str]:
+    """Language tag of the code fence left open at the end of ``text``
+    (``''`` for an untagged fence), or ``None`` if every fence is closed."""
+    lang = None
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if not stripped.startswith(FENCE):
+            continue
+        if lang is not None:
+            lang = None
+            continue
+        tail = stripped[len(FENCE):].strip()
+        if tail.endswith(FENCE):
+            # ```codice``` su una riga: aperto e chiuso
+            continue
+        lang = tail if LANG_TAG.fullmatch(tail) else ''
+    return lang
+
+
+def _cut_point(text: str, limit: int) -> Tuple[int, int]:
+    """Where to split ``text`` so the head fits in ``limit``: returns
+    ``(end_of_head, start_of_rest)``. Prefers a paragraph break, then a
+    line break, then a space, as long as it keeps at least half the
+    budget; otherwise cuts hard."""
+    window = text[:limit + 1]
+    for sep in ('\n\n', '\n', ' '):
+        idx = window.rfind(sep, 0, limit + 1)
+        if idx >= limit // 2:
+            return idx, idx + len(sep)
+    return limit, limit
+
+
+def take_chunk(text: str, limit: int = DISCORD_LIMIT) -> Tuple[str, str]:
+    """Split off the largest well-formed head of ``text`` that fits in
+    ``limit``. A code fence open at the cut is closed in the head and
+    re-opened (with its language) at the start of the rest."""
+    if len(text) <= limit:
+        return text, ''
+    # Riserva lo spazio per chiudere un blocco di codice
+    budget = limit - len(FENCE) - 1 if FENCE in text else limit
+    end, start = _cut_point(text, budget)
+    head, rest = text[:end].rstrip(), text[start:]
+    lang = _open_fence(head)
+    if lang is not None:
+        head += '\n' + FENCE
+        reopened = f"{FENCE}{lang}\n{rest}"
+        # Ogni chiamata deve accorciare il testo, o split_message non termina
+        if len(reopened) < len(text):
+            rest = reopened
+    return head, rest
+
+
+def split_message(text: str, limit: int = DISCORD_LIMIT, footer: str = '') -> List[str]:
+    """Pack ``text`` into as few Discord messages as possible, then append
+    ``footer`` to the last one (or as its own message if it doesn't fit)."""
+    chunks = []
+    rest = text
+    while rest:
+        head, rest = take_chunk(rest, limit)
+        if head:
+            chunks.append(head)
+    if footer:
+        if chunks and len(chunks[-1]) + len(footer) <= limit:
+            chunks[-1] += footer
+        else:
+            chunks.append(footer.lstrip('\n'))
+    return chunks
@@ -0,0 +1,80 @@
+# health_server.py - SONDE HTTP NELL'EVENT LOOP DEL BOT (AIOHTTP)
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# (pronto, dettagli dei singoli controlli)
+ReadinessCheck = Callable[[], Tuple[bool, Dict]]
+
+
+class HealthServer:
+    """Liveness and readiness probes served by aiohttp on the bot's loop.
+
+    Liveness (``/livez``, also ``/`` and ``/ping``) only says the event
+    loop is turning: a monitor task sleeps ``lag_interval`` and records
+    how late it wakes up, and the probe fails once that lag exceeds
+    ``max_loop_lag``. Readiness (``/readyz``) runs ``readiness`` and
+    fails while the bot should not receive traffic. Extra GET routes can
+    be added with ``add_route``.
+    """
+
+    def __init__(self, port: int, readiness: ReadinessCheck, host: str = '0.0.0.0',
+                 lag_interval: float = 1.0, max_loop_lag: float = 5.0):
+        self.host = host
+        self.port = port
+        self.readiness = readiness
+        self.lag_interval = lag_interval
+        self.max_loop_lag = max_loop_lag
+        self.loop_lag = 0.0
+        self.app = web.Application()
+        self.app.router.add_get('/', self.handle_live)
+        self.app.router.add_get('/ping', self.handle_live)
+        self.app.router.add_get('/livez', self.handle_live)
+        self.app.router.add_get('/readyz', self.handle_ready)
+        self._runner: Optional[web.AppRunner] = None
+        self._monitor: Optional[asyncio.Task] = None
+
+    def add_route(self, path: str, handler: Callable[[web.Request], Awaitable[web.StreamResponse]]):
+        self.app.router.add_get(path, handler)
+
+    async def _watch_loop(self):
+        while True:
+            expected = time.monotonic() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag = max(0.0, time.monotonic() - expected)
+
+    async def handle_live(self, request: web.Request) -> web.Response:
+        if self.loop_lag > self.max_loop_lag:
+            return web.Response(status=503, text=f"event loop lag {self.loop_lag:.1f}s")
+        return web.Response(text="OK")
+
+    async def handle_ready(self, request: web.Request) -> web.Response:
+        try:
+            ready, checks = self.readiness()
+        except Exception as e:
+            logger.error(f"❌ Errore controllo readiness: {e}")
+            ready, checks = False, {'error': str(e)}
+        body = {'status': 'ready' if ready else 'not_ready', 'loop_lag': round(self.loop_lag, 3), 'checks': checks}
+        return web.json_response(body, status=200 if ready else 503)
+
+    async def start(self):
+        if self._runner is not None:
+            return
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._monitor = asyncio.create_task(self._watch_loop())
+        logger.info(f"🌐 Server HTTP attivo sulla porta {self.port}")
+
+    async def stop(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,83 @@
+# launcher.py - AVVIO MULTI-PROCESSO CON SHARD
+#
+#   python launcher.py --shards 4 --processes 2
+#
+# Ogni processo figlio esegue discord_bot.py con SHARD_COUNT / SHARD_IDS
+# impostati e una porta web propria (PORT, PORT+1, ...). Crediti, preferenze
+# e rate limit usano i backend SQLite condivisi; /health di qualsiasi
+# processo aggrega lo stato di tutti gli shard.
+import os
+import sys
+import time
+import signal
+import argparse
+import logging
+import subprocess
+
+from sharding import shard_ranges
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - launcher - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger('launcher')
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'discord_bot.py')
+
+
+def spawn(index, shard_ids, shard_count, base_port):
+    env = dict(os.environ)
+    env['SHARD_COUNT'] = str(shard_count)
+    env['SHARD_IDS'] = ','.join(str(s) for s in shard_ids)
+    env['PORT'] = str(base_port + index)
+    logger.info(f"🚀 Processo {index}: shard {shard_ids} su porta {env['PORT']}")
+    return subprocess.Popen([sys.executable, BOT_SCRIPT], env=env)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the bot as N sharded processes')
+    parser.add_argument('--shards', type=int, required=True, help='total shard count')
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 10000)))
+    args = parser.parse_args()
+
+    ranges = shard_ranges(args.shards, args.processes)
+    procs = {i: spawn(i, ids, args.shards, args.port) for i, ids in enumerate(ranges)}
+    started = {i: time.monotonic() for i in procs}
+    backoff = {i: 1.0 for i in procs}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for proc in procs.values():
+            if proc.poll() is None:
+                proc.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while not stopping:
+        time.sleep(1)
+        for i, proc in list(procs.items()):
+            code = proc.poll()
+            if code is None or stopping:
+                continue
+            if time.monotonic() - started[i] > 300:
+                backoff[i] = 1.0
+            logger.warning(f"⚠️ Processo {i} terminato (exit {code}), riavvio tra {backoff[i]:.0f}s")
+            time.sleep(backoff[i])
+            backoff[i] = min(backoff[i] * 2, 60.0)
+            procs[i] = spawn(i, ranges[i], args.shards, args.port)
+            started[i] = time.monotonic()
+
+    for proc in procs.values():
+        try:
+            proc.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# llm_backends.py - PROVIDER LLM INTERCAMBIABILI (GEMINI / STAND-IN HTTP LOCALE)
+import json
+import logging
+from typing import AsyncIterator, Callable, Dict, Optional
+
+from ai_client import ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """Upstream failure reported by a backend (bad status, malformed reply)."""
+
+
+class LLMBackend:
+    """Provider interface used by ``AIGateway``.
+
+    ``generate`` returns the whole reply text; ``stream`` yields text
+    pieces as they arrive. Timeouts and concurrency are the gateway's
+    job, so backends just make the call and must stop promptly when
+    cancelled. ``options`` are provider-neutral generation overrides
+    (e.g. ``max_output_tokens``).
+    """
+
+    name = 'base'
+
+    async def generate(self, api_key: str, mode: str, language: str, prompt: str, **options) -> str:
+        raise NotImplementedError
+
+    def stream(self, api_key: str, mode: str, language: str, prompt: str, **options) -> AsyncIterator[str]:
+        raise NotImplementedError
+
+    def warmup(self):
+        """Blocking one-off preparation (imports, ...), run in a thread at startup."""
+
+    async def close(self):
+        pass
+
+
+# ==================== GEMINI ====================
+class GeminiBackend(LLMBackend):
+    """Google Gemini through ``google.generativeai``, with one cached model
+    per ``(api_key, mode, language)`` from a ``ModelRegistry``."""
+
+    name = 'gemini'
+
+    def __init__(self, registry: ModelRegistry):
+        self.registry = registry
+
+    def _call(self, api_key, mode, language, prompt, stream, options):
+        model = self.registry.get(api_key, mode, language)
+        kwargs = {}
+        if options:
+            params = {**self.registry.params_for(mode, language), **options}
+            kwargs['generation_config'] = self.registry.genai.types.GenerationConfig(**params)
+        return model.generate_content_async(prompt, stream=stream, **kwargs)
+
+    async def generate(self, api_key, mode, language, prompt, **options):
+        response = await self._call(api_key, mode, language, prompt, False, options)
+        return response.text if response else ''
+
+    async def stream(self, api_key, mode, language, prompt, **options):
+        response = await self._call(api_key, mode, language, prompt, True, options)
+        async for chunk in response:
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk finale con soli metadati (finish reason / safety)
+                continue
+            if text:
+                yield text
+
+    def warmup(self):
+        self.registry.genai
+
+
+# ==================== STAND-IN HTTP LOCALE ====================
+class HTTPBackend(LLMBackend):
+    """Client for ``llm_standin.py`` (or any server speaking its protocol):
+    ``POST /generate`` with ``{prompt, mode, language, options, stream}``
+    answers ``{"text": ...}``, or NDJSON ``{"text": ...}`` lines when
+    streaming. Lets load and failure-path tests run with no network."""
+
+    name = 'http'
+
+    def __init__(self, url: str, session_factory: Optional[Callable] = None):
+        self.url = url.rstrip('/')
+        self.session_factory = session_factory
+        self._session = None
+
+    def _client(self):
+        if self._session is None:
+            import aiohttp
+            self._session = (self.session_factory or aiohttp.ClientSession)()
+        return self._session
+
+    def _payload(self, mode, language, prompt, stream, options) -> Dict:
+        return {'prompt': prompt, 'mode': mode, 'language': language, 'options': options, 'stream': stream}
+
+    async def generate(self, api_key, mode, language, prompt, **options):
+        async with self._client().post(
+            f"{self.url}/generate", json=self._payload(mode, language, prompt, False, options)
+        ) as response:
+            if response.status != 200:
+                raise LLMError(f"HTTP {response.status}: {(await response.text())[:200]}")
+            body = await response.json()
+        return body.get('text', '')
+
+    async def stream(self, api_key, mode, language, prompt, **options):
+        async with self._client().post(
+            f"{self.url}/generate", json=self._payload(mode, language, prompt, True, options)
+        ) as response:
+            if response.status != 200:
+                raise LLMError(f"HTTP {response.status}: {(await response.text())[:200]}")
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    raise LLMError(chunk['error'])
+                if chunk.get('text'):
+                    yield chunk['text']
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+def create_llm_backend(backend: str, registry: Optional[ModelRegistry] = None,
+                       url: Optional[str] = None) -> LLMBackend:
+    if backend == 'gemini':
+        return GeminiBackend(registry)
+    if backend == 'http':
+        return HTTPBackend(url)
+    raise ValueError(f"LLM_BACKEND sconosciuto: {backend}")
@@ -0,0 +1,142 @@
+# llm_standin.py - SERVER LLM FINTO PER TEST DI CARICO E DI GUASTO, OFFLINE
+#
+#   python llm_standin.py [--port 8808] [--latency 0.5] [--jitter 0.1]
+#                         [--error-rate 0.0] [--timeout-rate 0.0]
+#
+#   LLM_BACKEND=http LLM_HTTP_URL=http://127.0.0.1:8808 python discord_bot.py
+#
+# Parla il protocollo di HTTPBackend (llm_backends.py). I guasti si possono
+# iniettare in tre modi:
+#   - a caso, con --error-rate / --timeout-rate;
+#   - a runtime: POST /faults {"latency": 2, "error_rate": 0.5, ...};
+#   - per singolo messaggio, con marcatori nel prompt: [[error]], [[timeout]],
+#     [[slow:3.5]] (secondi), [[empty]].
+# Un "timeout" tiene la richiesta aperta senza rispondere, così è il bot a
+# dover scadere, cancellare la chiamata e restituire i crediti.
+import re
+import json
+import random
+import asyncio
+import argparse
+import logging
+
+from aiohttp import web
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - llm_standin - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger('llm_standin')
+
+MARKER = re.compile(r'\[\[(error|timeout|empty|slow)(?::([\d.]+))?\]\]')
+HANG_SECONDS = 3600
+
+
+class Faults:
+    def __init__(self, latency=0.5, jitter=0.1, error_rate=0.0, timeout_rate=0.0, chunks=8, reply_chars=800):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.chunks = chunks
+        self.reply_chars = reply_chars
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def update(self, values):
+        for key, value in values.items():
+            if key in vars(self):
+                setattr(self, key, type(getattr(self, key))(value))
+
+
+def plan(prompt, faults, rng):
+    """Decide this request's fate: ``(action, latency)`` with action one of
+    ok / error / timeout / empty. Prompt markers win over random faults."""
+    latency = max(0.0, faults.latency + rng.uniform(-faults.jitter, faults.jitter))
+    actions = {match.group(1): match.group(2) for match in MARKER.finditer(prompt)}
+    if 'slow' in actions:
+        latency = float(actions['slow'] or 5.0)
+    for action in ('timeout', 'error', 'empty'):
+        if action in actions:
+            return action, latency
+    roll = rng.random()
+    if roll < faults.timeout_rate:
+        return 'timeout', latency
+    if roll < faults.timeout_rate + faults.error_rate:
+        return 'error', latency
+    return 'ok', latency
+
+
+def reply_text(prompt, faults):
+    words = prompt.split()[-1:] or ['nothing']
+    body = f"Stand-in reply about {words[0]}. " + 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 40
+    return body[:faults.reply_chars]
+
+
+def make_app(faults, seed=None):
+    rng = random.Random(seed)
+    stats = {'requests': 0, 'ok': 0, 'error': 0, 'timeout': 0, 'empty': 0}
+
+    async def generate(request):
+        body = await request.json()
+        prompt = body.get('prompt', '')
+        action, latency = plan(prompt, faults, rng)
+        stats['requests'] += 1
+        stats[action] += 1
+
+        if action == 'timeout':
+            await asyncio.sleep(HANG_SECONDS)
+        if action == 'error':
+            await asyncio.sleep(latency / 4)
+            return web.json_response({'error': 'injected upstream error'}, status=500)
+        text = '' if action == 'empty' else reply_text(prompt, faults)
+
+        if not body.get('stream'):
+            await asyncio.sleep(latency)
+            return web.json_response({'text': text})
+
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        size = max(1, len(text) // faults.chunks + 1)
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or ['']
+        for piece in pieces:
+            await asyncio.sleep(latency / len(pieces))
+            await response.write(json.dumps({'text': piece}).encode() + b'\n')
+        await response.write_eof()
+        return response
+
+    async def get_faults(request):
+        return web.json_response({**faults.as_dict(), 'stats': stats})
+
+    async def set_faults(request):
+        faults.update(await request.json())
+        logger.info(f"⚙️ Guasti aggiornati: {faults.as_dict()}")
+        return web.json_response(faults.as_dict())
+
+    app = web.Application()
+    app.router.add_post('/generate', generate)
+    app.router.add_get('/faults', get_faults)
+    app.router.add_post('/faults', set_faults)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local LLM stand-in with fault injection')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8808)
+    parser.add_argument('--latency', type=float, default=0.5, help='seconds per reply (spread over chunks)')
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    faults = Faults(args.latency, args.jitter, args.error_rate, args.timeout_rate)
+    logger.info(f"🧪 Stand-in LLM su http://{args.host}:{args.port} {faults.as_dict()}")
+    web.run_app(make_app(faults, args.seed), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
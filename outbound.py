@@ -0,0 +1,137 @@
+# outbound.py - CODA DI INVIO PER CANALE (RATE LIMIT DISCORD)
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Deque, Dict, List, MutableMapping, Optional
+
+from formatting import DISCORD_LIMIT
+from rate_limit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class _Outgoing:
+    __slots__ = ('channel', 'content', 'kwargs', 'coalesce', 'future', 'queued_at')
+
+    def __init__(self, channel, content, kwargs, coalesce, future, queued_at):
+        self.channel = channel
+        self.content = content
+        self.kwargs = kwargs
+        self.coalesce = coalesce
+        self.future = future
+        self.queued_at = queued_at
+
+    @property
+    def mergeable(self) -> bool:
+        return self.coalesce and not self.kwargs and isinstance(self.content, str)
+
+
+class OutboundDispatcher:
+    """Central per-channel send queue.
+
+    Each channel gets a FIFO drained by its own worker task, paced by a
+    token bucket matching Discord's per-channel message bucket (5 messages
+    per 5 s), so bursts wait here instead of inside a handler after a 429.
+    Adjacent plain-text messages that fit together are sent as one.
+    ``store`` is the mapping for the per-channel buckets (a bounded
+    ``ExpiringDict`` in the bot; a bucket idle for ``period`` is full
+    again, so dropping it loses nothing).
+    """
+
+    def __init__(self, per_channel: int = 5, period: float = 5.0, clock=time.monotonic,
+                 store: Optional[MutableMapping] = None):
+        self.clock = clock
+        self.buckets = TokenBucket(per_channel, period, clock=clock, store=store)
+        self.queues: Dict[int, Deque[_Outgoing]] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+        self.delays: Deque[float] = deque(maxlen=1000)
+        self.total_sent = 0
+        self.total_coalesced = 0
+        self.total_429 = 0
+
+    async def send(self, channel, content: Optional[str] = None, *, coalesce: bool = True, **kwargs):
+        """Queue a message for ``channel`` and return the sent message
+        (shared by every request merged into it)."""
+        future = asyncio.get_running_loop().create_future()
+        key = channel.id
+        queue = self.queues.get(key)
+        if queue is None:
+            queue = self.queues[key] = deque()
+        queue.append(_Outgoing(channel, content, kwargs, coalesce, future, self.clock()))
+        if key not in self.workers:
+            self.workers[key] = asyncio.create_task(self._drain(key, queue))
+        return await future
+
+    async def _drain(self, key: int, queue: Deque[_Outgoing]):
+        try:
+            while queue:
+                wait = self.buckets.retry_after(key)
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                    continue
+                self.buckets.hit(key)
+
+                batch = self._take_batch(queue)
+                head = batch[0]
+                content = '\n'.join(item.content for item in batch) if len(batch) > 1 else head.content
+                try:
+                    message = await head.channel.send(content, **head.kwargs)
+                except Exception as e:
+                    if getattr(e, 'status', None) == 429 or hasattr(e, 'retry_after'):
+                        self.total_429 += 1
+                        queue.extendleft(reversed(batch))
+                        await asyncio.sleep(getattr(e, 'retry_after', None) or 1.0)
+                        continue
+                    for item in batch:
+                        if not item.future.done():
+                            item.future.set_exception(e)
+                    continue
+
+                now = self.clock()
+                self.total_sent += 1
+                self.total_coalesced += len(batch) - 1
+                for item in batch:
+                    self.delays.append(now - item.queued_at)
+                    if not item.future.done():
+                        item.future.set_result(message)
+        finally:
+            del self.workers[key]
+            if not queue:
+                del self.queues[key]
+
+    def _take_batch(self, queue: Deque[_Outgoing]) -> List[_Outgoing]:
+        batch = [queue.popleft()]
+        if not batch[0].mergeable:
+            return batch
+        size = len(batch[0].content)
+        while queue and queue[0].mergeable and size + 1 + len(queue[0].content) <= DISCORD_LIMIT:
+            item = queue.popleft()
+            size += 1 + len(item.content)
+            batch.append(item)
+        return batch
+
+    def stats(self) -> Dict[str, float]:
+        delays = sorted(self.delays)
+        return {
+            'channels': len(self.queues),
+            'queued': sum(len(q) for q in self.queues.values()),
+            'sent': self.total_sent,
+            'coalesced': self.total_coalesced,
+            'rate_limited_429': self.total_429,
+            'delay_p50': delays[len(delays) // 2] if delays else 0.0,
+            'delay_p95': delays[min(len(delays) - 1, int(len(delays) * 0.95))] if delays else 0.0,
+        }
+
+
+class RateLimitLogCounter(logging.Handler):
+    """Counts the 429 retries discord.py handles internally (it logs them
+    on ``discord.http`` instead of raising)."""
+
+    def __init__(self, dispatcher: OutboundDispatcher):
+        super().__init__(level=logging.WARNING)
+        self.dispatcher = dispatcher
+
+    def emit(self, record: logging.LogRecord):
+        if '429' in record.getMessage():
+            self.dispatcher.total_429 += 1
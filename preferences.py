@@ -0,0 +1,199 @@
+# preferences.py - PREFERENZE UTENTE (LINGUA / MODALITÀ)
+import sqlite3
+import asyncio
+import threading
+import logging
+from enum import IntEnum
+from typing import Dict, MutableMapping, Optional
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('language', 'mode')
+
+
+class Language(IntEnum):
+    ENGLISH = 0
+    ITALIAN = 1
+
+
+class Mode(IntEnum):
+    UNCENSORED = 0
+    CREATIVE = 1
+    TECHNICAL = 2
+
+
+# Un utente = un intero: lingua nei 4 bit bassi, modalità sopra. 0 = default
+DEFAULT_CODE = 0
+
+
+def encode(language: str, mode: str) -> int:
+    try:
+        return Language[language.upper()] | Mode[mode.upper()] << 4
+    except KeyError:
+        raise ValueError(f"Preferenza sconosciuta: {language}/{mode}") from None
+
+
+def decode(code: int) -> Dict[str, str]:
+    return {
+        'language': Language(code & 0xF).name.lower(),
+        'mode': Mode(code >> 4).name.lower(),
+    }
+
+
+def _replace(code: int, field: str, value: str) -> int:
+    pref = decode(code)
+    if field not in FIELDS:
+        raise ValueError(f"Preferenza sconosciuta: {field}")
+    pref[field] = value
+    return encode(pref['language'], pref['mode'])
+
+
+class PreferenceStore:
+    """Preferences persisted in SQLite (the credit ledger's file by
+    default) as one packed integer per user.
+
+    Reads go through ``cache`` (an ``ExpiringDict`` of codes; misses are
+    cached too, so unknown users cost one query, run in a worker thread).
+    Writes update the cache at once and are flushed in batches by a
+    background task every ``flush_interval`` seconds, and by ``flush`` on
+    shutdown. A batch holds the changed fields, not whole codes: each is
+    applied to the row as re-read inside the write transaction, so a
+    stale cache never reverts a field another process changed. With
+    several processes on one file, keep the cache TTL short: a change
+    made in another process is seen once the cached code expires.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS user_prefs (
+            user_id INTEGER PRIMARY KEY,
+            code INTEGER NOT NULL
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str, cache: Optional[MutableMapping] = None, flush_interval: float = 2.0):
+        self.path = path
+        self.cache = cache if cache is not None else {}
+        self.flush_interval = flush_interval
+        # user_id -> {campo: valore} non ancora scritti
+        self.dirty: Dict[int, Dict[str, str]] = {}
+        self.writing: Dict[int, Dict[str, str]] = {}
+        self._local = threading.local()
+        self._flush_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.total_flushed = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30.0, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def open(self):
+        """Create the table and import rows from the old text-column
+        ``preferences`` table, if present (once; it is dropped after)."""
+        conn = self._conn()
+        conn.executescript(self.SCHEMA)
+        legacy = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'preferences'"
+        ).fetchone()
+        if legacy is None:
+            return
+        rows = []
+        for user_id, language, mode in conn.execute('SELECT user_id, language, mode FROM preferences'):
+            try:
+                rows.append((user_id, encode(language or 'english', mode or 'uncensored')))
+            except ValueError:
+                continue
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany('INSERT OR IGNORE INTO user_prefs VALUES (?, ?)', rows)
+            conn.execute('DROP TABLE preferences')
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        logger.info(f"📦 Migrate {len(rows)} preferenze nel formato compatto")
+
+    def _read(self, user_id: int) -> int:
+        row = self._conn().execute('SELECT code FROM user_prefs WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else DEFAULT_CODE
+
+    def _pending(self, user_id: int, code: int) -> int:
+        # Modifiche non ancora su disco: prima il lotto in scrittura, poi le nuove
+        for batch in (self.writing, self.dirty):
+            for field, value in batch.get(user_id, {}).items():
+                code = _replace(code, field, value)
+        return code
+
+    async def get(self, user_id: int) -> Dict[str, str]:
+        code = self.cache.get(user_id)
+        while code is None:
+            flushed = self.total_flushed
+            stored = await asyncio.get_running_loop().run_in_executor(None, self._read, user_id)
+            # Un lotto scritto durante la lettura potrebbe mancare: si rilegge
+            if self.total_flushed == flushed:
+                code = self.cache[user_id] = self._pending(user_id, stored)
+        return decode(code)
+
+    def set(self, user_id: int, field: str, value: str):
+        code = self.cache.get(user_id)
+        if code is not None:
+            self.cache[user_id] = _replace(code, field, value)
+        else:
+            _replace(DEFAULT_CODE, field, value)  # solo validazione
+        self.dirty.setdefault(user_id, {})[field] = value
+
+    def _write(self, batch: Dict[int, Dict[str, str]]):
+        with self._flush_lock:
+            conn = self._conn()
+            with conn:
+                conn.execute('BEGIN IMMEDIATE')
+                rows = []
+                for user_id, changes in batch.items():
+                    code = self._read(user_id)
+                    for field, value in changes.items():
+                        code = _replace(code, field, value)
+                    rows.append((user_id, code))
+                conn.executemany('INSERT OR REPLACE INTO user_prefs VALUES (?, ?)', rows)
+        self.total_flushed += len(batch)
+
+    def _requeue(self, batch: Dict[int, Dict[str, str]]):
+        # Senza sovrascrivere modifiche arrivate nel frattempo
+        for user_id, changes in batch.items():
+            pending = self.dirty.setdefault(user_id, {})
+            for field, value in changes.items():
+                pending.setdefault(field, value)
+
+    def flush(self) -> int:
+        """Write pending changes in one transaction; returns how many."""
+        batch, self.dirty = self.dirty, {}
+        if batch:
+            try:
+                self._write(batch)
+            except Exception:
+                self._requeue(batch)
+                raise
+        return len(batch)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not self.dirty:
+                continue
+            # Lo scambio avviene nel loop: set() non tocca mai il batch in scrittura
+            batch, self.dirty = self.dirty, {}
+            self.writing = batch
+            try:
+                await loop.run_in_executor(None, self._write, batch)
+            except Exception as e:
+                self._requeue(batch)
+                logger.error(f"❌ Errore salvataggio preferenze: {e}")
+            finally:
+                self.writing = {}
@@ -0,0 +1,183 @@
+# rate_limit.py - MOTORE DI RATE LIMITING O(1)
+import time
+import sqlite3
+from collections import deque
+from typing import Callable, Deque, Hashable, List, MutableMapping, Optional
+
+
+class SlidingWindow:
+    """Exact sliding-window counter: at most ``limit`` hits per ``window``
+    seconds for each key.
+
+    Every key keeps a deque of hit timestamps; expired ones are popped from
+    the left, so each timestamp is appended and removed exactly once and a
+    check is amortized O(1). Uses a monotonic clock, immune to wall-clock
+    jumps. ``store`` lets callers supply a bounded mapping for the per-key
+    state (any dict-like with ``get`` and item assignment).
+    """
+
+    def __init__(self, limit: int, window: float, clock: Callable[[], float] = time.monotonic,
+                 store: Optional[MutableMapping] = None):
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self.hits: MutableMapping[Hashable, Deque[float]] = store if store is not None else {}
+
+    def hit(self, key: Hashable = None) -> bool:
+        """Record a hit for ``key`` if it is under the limit."""
+        now = self.clock()
+        hits = self.hits.get(key)
+        if hits is None:
+            hits = self.hits[key] = deque()
+        else:
+            cutoff = now - self.window
+            while hits and hits[0] <= cutoff:
+                hits.popleft()
+        if len(hits) >= self.limit:
+            return False
+        hits.append(now)
+        return True
+
+    def retry_after(self, key: Hashable = None) -> float:
+        """Seconds until ``key`` can hit again (0 if it can now)."""
+        hits = self.hits.get(key)
+        if not hits or len(hits) < self.limit:
+            return 0.0
+        return max(0.0, hits[0] + self.window - self.clock())
+
+
+class TokenBucket:
+    """Token bucket per key: ``capacity`` burst, refilled at
+    ``capacity / period`` tokens per second. O(1) per check and only two
+    floats of state per key."""
+
+    def __init__(self, capacity: int, period: float, clock: Callable[[], float] = time.monotonic,
+                 store: Optional[MutableMapping] = None):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.clock = clock
+        # key -> [tokens, last_refill]
+        self.buckets: MutableMapping[Hashable, List[float]] = store if store is not None else {}
+
+    def hit(self, key: Hashable = None, cost: float = 1.0) -> bool:
+        now = self.clock()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = [float(self.capacity), now]
+        else:
+            bucket[0] = min(self.capacity, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < cost:
+            return False
+        bucket[0] -= cost
+        return True
+
+    def retry_after(self, key: Hashable = None, cost: float = 1.0) -> float:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return 0.0
+        tokens = min(self.capacity, bucket[0] + (self.clock() - bucket[1]) * self.rate)
+        return max(0.0, (cost - tokens) / self.rate)
+
+
+# ==================== BACKEND CONDIVISI ====================
+class MemoryRateLimitBackend:
+    """Per-process backend: one ``SlidingWindow`` per scope.
+
+    ``store_factory(scope, window)`` returns the mapping used for that
+    scope's per-key state (a plain dict by default).
+    """
+
+    # In memoria: si chiama direttamente dal loop
+    blocking = False
+
+    def __init__(self, store_factory: Optional[Callable[[str, float], MutableMapping]] = None):
+        self.store_factory = store_factory
+        self.windows = {}
+
+    def hit(self, scope: str, key: Hashable, limit: int, window: float) -> bool:
+        sliding = self.windows.get(scope)
+        if sliding is None:
+            store = self.store_factory(scope, window) if self.store_factory else None
+            sliding = self.windows[scope] = SlidingWindow(limit, window, store=store)
+        return sliding.hit(key)
+
+
+class SQLiteRateLimitBackend:
+    """Host-wide backend shared by every bot process through one SQLite
+    file.
+
+    Each check prunes, counts and records the hit inside a single
+    ``BEGIN IMMEDIATE`` transaction, so check-and-increment is atomic
+    across processes. Timestamps are wall-clock (``time.time()``): the
+    file outlives reboots, which restart the monotonic clock near zero.
+    Rows more than ``MAX_CLOCK_SKEW`` seconds in the future (the clock
+    stepped back) are pruned like expired ones. The state is disposable,
+    so the database runs with ``synchronous=OFF``.
+
+    ``hit`` blocks on disk and on other processes' locks (``blocking``),
+    so callers on an event loop run it in a worker thread.
+    """
+
+    PURGE_EVERY = 1000
+    MAX_CLOCK_SKEW = 1.0
+    blocking = True
+
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        self.path = path
+        self.clock = clock
+        # Creata qui, usata dal thread del chiamante (uno alla volta)
+        self.conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS hits (scope TEXT NOT NULL, key TEXT NOT NULL, ts REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS hits_scope_key_ts ON hits (scope, key, ts)')
+        self._max_window = 0.0
+        self._since_purge = 0
+
+    def hit(self, scope: str, key: Hashable, limit: int, window: float) -> bool:
+        now = self.clock()
+        key = str(key)
+        self._max_window = max(self._max_window, window)
+        conn = self.conn
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'DELETE FROM hits WHERE scope = ? AND key = ? AND (ts <= ? OR ts > ?)',
+                (scope, key, now - window, now + self.MAX_CLOCK_SKEW)
+            )
+            count = conn.execute(
+                'SELECT COUNT(*) FROM hits WHERE scope = ? AND key = ?', (scope, key)
+            ).fetchone()[0]
+            allowed = count < limit
+            if allowed:
+                conn.execute('INSERT INTO hits (scope, key, ts) VALUES (?, ?, ?)', (scope, key, now))
+
+            self._since_purge += 1
+            if self._since_purge >= self.PURGE_EVERY:
+                # Rows of keys that went quiet are never pruned by their own checks
+                conn.execute(
+                    'DELETE FROM hits WHERE ts <= ? OR ts > ?',
+                    (now - self._max_window, now + self.MAX_CLOCK_SKEW)
+                )
+                self._since_purge = 0
+            conn.execute('COMMIT')
+            return allowed
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def close(self):
+        self.conn.close()
+
+
+def create_rate_limit_backend(backend: str, path: str = 'rate_limits.db',
+                              store_factory: Optional[Callable[[str, float], MutableMapping]] = None):
+    """Build the configured limiter backend (``memory`` or ``sqlite``)."""
+    if backend == 'memory':
+        return MemoryRateLimitBackend(store_factory)
+    if backend == 'sqlite':
+        return SQLiteRateLimitBackend(path)
+    raise ValueError(f"Backend rate limit sconosciuto: {backend}")
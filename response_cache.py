@@ -0,0 +1,69 @@
+# response_cache.py - CACHE DELLE RISPOSTE PER PROMPT RIPETUTI
+import hashlib
+from typing import Dict, Hashable, Iterable, Optional
+
+from bounded_state import ExpiringDict
+from metrics import RESPONSE_CACHE_LOOKUPS
+
+
+def normalize_prompt(text: str) -> str:
+    """Case- and whitespace-insensitive form of a prompt, so "Tell me a
+    story" and "tell me  a story " share an entry."""
+    return ' '.join(text.lower().split())
+
+
+def request_key(prompt: str, mode: str, language: str, system_prompt: str, params: Dict) -> Hashable:
+    """Identity of a stateless AI request: two requests with the same key
+    would be sent to Gemini with the same prompt and settings."""
+    system = hashlib.blake2b(system_prompt.encode(), digest_size=8).digest()
+    return (normalize_prompt(prompt), mode, language, system, tuple(sorted(params.items())))
+
+
+class ResponseCache:
+    """Generated replies keyed on the normalized prompt plus everything
+    else that shapes the output (mode, language, system prompt and
+    generation parameters).
+
+    Entries live in an ``ExpiringDict`` (TTL + LRU), so it can be handed
+    to the ``StateJanitor``. The TTL counts from when a reply was stored,
+    not from its last hit, so popular replies are regenerated too. Modes
+    in ``disabled_modes`` are never cached.
+    """
+
+    def __init__(self, ttl: float = 3600, maxsize: int = 1000, disabled_modes: Iterable[str] = ()):
+        self.entries = ExpiringDict(ttl=ttl, maxsize=maxsize, refresh_on_read=False)
+        self.disabled_modes = frozenset(disabled_modes)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, prompt: str, mode: str, language: str, system_prompt: str,
+            params: Dict) -> Optional[Hashable]:
+        """Cache key, or ``None`` if this request must not be cached."""
+        if mode in self.disabled_modes:
+            return None
+        return request_key(prompt, mode, language, system_prompt, params)
+
+    def get(self, key: Optional[Hashable]) -> Optional[str]:
+        if key is None:
+            return None
+        response = self.entries.get(key)
+        if response is None:
+            self.misses += 1
+            RESPONSE_CACHE_LOOKUPS.inc(result='miss')
+        else:
+            self.hits += 1
+            RESPONSE_CACHE_LOOKUPS.inc(result='hit')
+        return response
+
+    def put(self, key: Optional[Hashable], response: str):
+        if key is not None and response:
+            self.entries[key] = response
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
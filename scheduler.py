@@ -0,0 +1,183 @@
+# scheduler.py - CODA AI EQUA CON BACKPRESSURE
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised by ``FairScheduler.enqueue`` when a job is shed."""
+
+    def __init__(self, scope: str):
+        super().__init__(f"AI queue full ({scope})")
+        self.scope = scope
+
+
+class Ticket:
+    """A place in the AI queue. ``async with ticket`` waits for the turn
+    and frees the slot on exit."""
+
+    __slots__ = ('scheduler', 'user_id', 'group', 'future', 'enqueued_at')
+
+    def __init__(self, scheduler: 'FairScheduler', user_id: int, group: Hashable):
+        self.scheduler = scheduler
+        self.user_id = user_id
+        self.group = group
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued_at = scheduler.clock()
+
+    @property
+    def position(self) -> int:
+        """1-based position among waiting jobs, 0 once the job may run."""
+        return self.scheduler.position(self)
+
+    def abandon(self):
+        """Give up the place (or the slot, if already granted) without
+        entering; for failures between ``enqueue`` and ``async with``."""
+        self.scheduler._abandon(self)
+
+    async def __aenter__(self):
+        try:
+            await asyncio.shield(self.future)
+        except asyncio.CancelledError:
+            self.abandon()
+            raise
+        self.scheduler._record_wait(self.scheduler.clock() - self.enqueued_at)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.scheduler._finish()
+
+
+class FairScheduler:
+    """Admission queue for AI jobs.
+
+    At most ``capacity`` jobs run at once. Waiting jobs are served
+    round-robin across groups (guilds, with all DMs as group 0) and, within
+    a group, round-robin across users, so one busy guild or user cannot
+    starve the others. Jobs beyond ``max_depth`` waiting, or beyond
+    ``max_per_user`` waiting for one user, are shed with ``QueueFull``.
+    """
+
+    def __init__(self, capacity: int, max_depth: int = 100, max_per_user: int = 3,
+                 clock=time.monotonic):
+        self.capacity = capacity
+        self.max_depth = max_depth
+        self.max_per_user = max_per_user
+        self.clock = clock
+        self.active = 0
+        self.depth = 0
+        # group -> user -> waiting tickets; key order is the rotation order
+        self.queues: 'OrderedDict[Hashable, OrderedDict[int, Deque[Ticket]]]' = OrderedDict()
+        self.waits: Deque[float] = deque(maxlen=1000)
+        self.total_admitted = 0
+        self.total_shed = 0
+
+    def enqueue(self, user_id: int, group: Hashable) -> Ticket:
+        ticket = Ticket(self, user_id, group)
+        if self.active < self.capacity and self.depth == 0:
+            self._grant(ticket)
+            return ticket
+
+        users = self.queues.get(group)
+        waiting = users.get(user_id) if users else None
+        if self.depth >= self.max_depth:
+            self.total_shed += 1
+            raise QueueFull('global')
+        if waiting is not None and len(waiting) >= self.max_per_user:
+            self.total_shed += 1
+            raise QueueFull('user')
+
+        if users is None:
+            users = self.queues[group] = OrderedDict()
+        if waiting is None:
+            waiting = users[user_id] = deque()
+        waiting.append(ticket)
+        self.depth += 1
+        return ticket
+
+    def _grant(self, ticket: Ticket):
+        self.active += 1
+        self.total_admitted += 1
+        ticket.future.set_result(None)
+
+    def _next(self) -> Optional[Ticket]:
+        if not self.queues:
+            return None
+        group, users = next(iter(self.queues.items()))
+        user_id, waiting = next(iter(users.items()))
+        ticket = waiting.popleft()
+        if waiting:
+            users.move_to_end(user_id)
+        else:
+            del users[user_id]
+        if users:
+            self.queues.move_to_end(group)
+        else:
+            del self.queues[group]
+        self.depth -= 1
+        return ticket
+
+    def _dispatch(self):
+        while self.active < self.capacity:
+            ticket = self._next()
+            if ticket is None:
+                return
+            self._grant(ticket)
+
+    def _finish(self):
+        self.active -= 1
+        self._dispatch()
+
+    def _abandon(self, ticket: Ticket):
+        if ticket.future.done():
+            # Turno già assegnato: libera lo slot
+            self._finish()
+            return
+        ticket.future.cancel()
+        users = self.queues.get(ticket.group)
+        waiting = users.get(ticket.user_id) if users else None
+        if waiting and ticket in waiting:
+            waiting.remove(ticket)
+            self.depth -= 1
+            if not waiting:
+                del users[ticket.user_id]
+            if not users:
+                del self.queues[ticket.group]
+
+    def position(self, ticket: Ticket) -> int:
+        if ticket.future.done():
+            return 0
+        # Simula la rotazione senza toccare le code: O(profondità)
+        groups = [[deque(w) for w in users.values()] for users in self.queues.values()]
+        position = 0
+        while groups:
+            for users in list(groups):
+                waiting = users.pop(0)
+                position += 1
+                if waiting.popleft() is ticket:
+                    return position
+                if waiting:
+                    users.append(waiting)
+                if not users:
+                    groups.remove(users)
+        return 0
+
+    def _record_wait(self, seconds: float):
+        self.waits.append(seconds)
+
+    def stats(self) -> Dict[str, float]:
+        waits = sorted(self.waits)
+        return {
+            'active': self.active,
+            'capacity': self.capacity,
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'admitted': self.total_admitted,
+            'shed': self.total_shed,
+            'wait_p50': waits[len(waits) // 2] if waits else 0.0,
+            'wait_p95': waits[min(len(waits) - 1, int(len(waits) * 0.95))] if waits else 0.0,
+        }
@@ -0,0 +1,107 @@
+# sharding.py - STATO DEGLI SHARD CONDIVISO TRA PROCESSI
+import os
+import time
+import sqlite3
+from contextlib import closing
+from typing import Dict, List, Optional
+
+
+def parse_shard_ids(value: Optional[str]) -> Optional[List[int]]:
+    """``"0,1,2"`` or ``"0-3"`` -> list of shard IDs (``None`` if unset)."""
+    if not value:
+        return None
+    ids = []
+    for part in value.split(','):
+        part = part.strip()
+        if '-' in part:
+            start, end = part.split('-', 1)
+            ids.extend(range(int(start), int(end) + 1))
+        elif part:
+            ids.append(int(part))
+    return ids
+
+
+def shard_ranges(shard_count: int, processes: int) -> List[List[int]]:
+    """Split ``range(shard_count)`` into ``processes`` contiguous groups."""
+    processes = max(1, min(processes, shard_count))
+    base, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        size = base + (1 if i < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+class ShardStatusBoard:
+    """Per-shard heartbeat rows in a host-local SQLite file.
+
+    Each bot process periodically publishes the state of the shards it
+    runs; any process can then aggregate the whole deployment for
+    ``/health``. Connections are opened per call because the board is
+    read from an executor thread and written from the event loop.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS shard_status (
+            shard_id INTEGER PRIMARY KEY,
+            pid INTEGER NOT NULL,
+            ready INTEGER NOT NULL,
+            latency REAL,
+            guilds INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+    """
+
+    def __init__(self, path: str, stale_after: float = 60.0):
+        self.path = path
+        self.stale_after = stale_after
+        with closing(self._connect()) as conn, conn:
+            conn.executescript(self.SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5.0)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def publish(self, shards: Dict[int, Dict]):
+        """``shards`` maps shard ID -> ``{'ready', 'latency', 'guilds'}``."""
+        now = time.time()
+        pid = os.getpid()
+        rows = [
+            (shard_id, pid, int(info['ready']), info.get('latency'), info['guilds'], now)
+            for shard_id, info in shards.items()
+        ]
+        with closing(self._connect()) as conn, conn:
+            conn.executemany('INSERT OR REPLACE INTO shard_status VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def aggregate(self, shard_count: Optional[int] = None) -> Dict:
+        now = time.time()
+        with closing(self._connect()) as conn, conn:
+            rows = conn.execute(
+                'SELECT shard_id, pid, ready, latency, guilds, updated_at FROM shard_status ORDER BY shard_id'
+            ).fetchall()
+
+        shards = []
+        for shard_id, pid, ready, latency, guilds, updated_at in rows:
+            if shard_count is not None and shard_id >= shard_count:
+                continue
+            stale = now - updated_at > self.stale_after
+            shards.append({
+                'shard_id': shard_id,
+                'pid': pid,
+                'ready': bool(ready) and not stale,
+                'stale': stale,
+                'latency_ms': round(latency * 1000, 1) if latency is not None else None,
+                'guilds': guilds,
+            })
+
+        expected = shard_count if shard_count is not None else len(shards)
+        healthy = sum(1 for s in shards if s['ready'])
+        return {
+            'status': 'ok' if expected and healthy == expected else 'degraded',
+            'shards_expected': expected,
+            'shards_ready': healthy,
+            'guilds': sum(s['guilds'] for s in shards),
+            'shards': shards,
+        }
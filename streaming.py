@@ -0,0 +1,103 @@
+# streaming.py - RISPOSTE IN STREAMING CON EDIT PROGRESSIVI
+import time
+import logging
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+from formatting import DISCORD_LIMIT, take_chunk
+
+logger = logging.getLogger(__name__)
+
+# Limite pratico per messaggio (Discord: 2000), lascia spazio al footer
+MESSAGE_LIMIT = 1900
+
+
+class StreamingReply:
+    """Progressively delivered reply.
+
+    The first message is posted as soon as there is text; afterwards the
+    message is edited at most once every ``min_edit_interval`` seconds
+    (Discord allows 5 edits per 5 s per channel). When the text outgrows
+    ``limit`` the current message is finalized at a paragraph/line/fence
+    boundary and a new one is started. Past ``max_messages`` full
+    messages it stops and sets ``overflowed``: the caller then delivers
+    the whole text another way (as an attachment) instead of ``finish``.
+    """
+
+    def __init__(self, channel, min_edit_interval: float = 1.5, limit: int = MESSAGE_LIMIT,
+                 clock: Callable[[], float] = time.monotonic, send: Optional[Callable] = None,
+                 max_messages: Optional[int] = None):
+        self.channel = channel
+        self._send = send or channel.send
+        self.min_edit_interval = min_edit_interval
+        self.limit = limit
+        self.clock = clock
+        self.message = None
+        self.buffer = ''
+        self.shown = ''
+        self.last_update = 0.0
+        self.messages_sent = 0
+        self.max_messages = max_messages
+        self.overflowed = False
+
+    @property
+    def empty(self) -> bool:
+        return not self.buffer and self.messages_sent == 0
+
+    async def feed(self, text: str):
+        if self.overflowed:
+            return
+        self.buffer += text
+        while len(self.buffer) > self.limit:
+            head, self.buffer = take_chunk(self.buffer, self.limit)
+            await self._show(head)
+            self.message = None
+            self.shown = ''
+            if self.max_messages is not None and self.messages_sent >= self.max_messages:
+                self.overflowed = True
+                self.buffer = ''
+                return
+        if self.message is None or self.clock() - self.last_update >= self.min_edit_interval:
+            await self._show(self.buffer)
+
+    async def finish(self, footer: str = ''):
+        final = self.buffer + footer
+        if len(final) > DISCORD_LIMIT:
+            await self._show(self.buffer)
+            self.message = None
+            self.shown = ''
+            final = footer.lstrip('\n')
+        await self._show(final)
+
+    async def _show(self, content: str):
+        if not content or content == self.shown:
+            return
+        if self.message is None:
+            self.message = await self._send(content)
+            self.messages_sent += 1
+        else:
+            await self.message.edit(content=content)
+        self.shown = content
+        self.last_update = self.clock()
+
+
+class StreamMetrics:
+    """Rolling time-to-first-byte samples for streamed generations."""
+
+    def __init__(self, window: int = 500):
+        self.ttfb: Deque[float] = deque(maxlen=window)
+        self.total = 0
+
+    def record_ttfb(self, seconds: float):
+        self.ttfb.append(seconds)
+        self.total += 1
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        samples = sorted(self.ttfb)
+        if not samples:
+            return {'count': self.total, 'p50': None, 'p95': None}
+        return {
+            'count': self.total,
+            'p50': samples[len(samples) // 2],
+            'p95': samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        }
@@ -0,0 +1,94 @@
+# traffic.py - REGISTRAZIONE ANONIMA DEL TRAFFICO (PER IL REPLAY)
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TrafficRecorder:
+    """Appends one JSON line per incoming message to ``path``.
+
+    Events carry only what the replay needs: wall-clock time, salted
+    hashes of guild, channel and user IDs, message length and, for
+    ``!`` messages, the command name as resolved by ``command_name``
+    (``UNKNOWN_COMMAND`` when it resolves to nothing, so a typo or a
+    sentence starting with ``!`` never lands in the trace); never the
+    text. The salt is random
+    per recorder unless given, so traces from different runs cannot be
+    joined. Events are buffered and written by a background task every
+    ``flush_interval`` seconds (and by ``flush`` on shutdown).
+    """
+
+    UNKNOWN_COMMAND = '?'
+
+    def __init__(self, path: str, salt: Optional[str] = None, flush_interval: float = 5.0,
+                 prefix: str = '!', command_name: Optional[Callable[[str], Optional[str]]] = None):
+        self.path = path
+        self.salt = (salt or os.urandom(16).hex()).encode()
+        self.flush_interval = flush_interval
+        self.prefix = prefix
+        self.command_name = command_name
+        self.buffer: List[Dict] = []
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.total_recorded = 0
+
+    def _hash(self, value: int) -> str:
+        return hashlib.blake2b(str(value).encode(), key=self.salt, digest_size=8).hexdigest()
+
+    def record(self, message):
+        content = message.content
+        command = None
+        if content.startswith(self.prefix):
+            words = content[len(self.prefix):].split(maxsplit=1)
+            name = self.command_name(words[0]) if words and self.command_name else None
+            command = name or self.UNKNOWN_COMMAND
+        self.buffer.append({
+            't': round(time.time(), 3),
+            'guild': self._hash(message.guild.id) if message.guild else None,
+            'channel': self._hash(message.channel.id),
+            'user': self._hash(message.author.id),
+            'length': len(content),
+            'command': command,
+        })
+        self.total_recorded += 1
+
+    def _write(self, events: List[Dict]):
+        with self._lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(json.dumps(event, separators=(',', ':')) + '\n' for event in events)
+
+    def flush(self) -> int:
+        events, self.buffer = self.buffer, []
+        if events:
+            self._write(events)
+        return len(events)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if not self.buffer:
+                continue
+            events, self.buffer = self.buffer, []
+            try:
+                await loop.run_in_executor(None, self._write, events)
+            except Exception as e:
+                logger.error(f"❌ Errore scrittura traccia traffico: {e}")
+
+
+def load_trace(path: str) -> List[Dict]:
+    """Events of a trace file, sorted by time."""
+    with open(path, encoding='utf-8') as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    events.sort(key=lambda event: event['t'])
+    return events